@@ -1,5 +1,7 @@
+import core.cluster as cluster
 import core.config as config
 import core.constants as constants
+import core.gateway as gateway
 import core.logger as logger
 import core.prefix as prefix
 
@@ -20,7 +22,13 @@ VERSION = version_info(
 )
 
 
-class Core(commands.Bot):
+# Cluster workers are started by the cluster launcher with their slice of the shards, see cluster.py
+WORKER = cluster.assignment()
+
+# AutoShardedBot runs several gateway connections in one process, it's only used when sharding is enabled in constants.py (or this is a cluster worker).
+Bot = commands.AutoShardedBot if constants.SHARDING_ENABLED or WORKER is not None else commands.Bot
+
+class Core(Bot):
     async def shutdown(self):
         """This calmly and quietly closes the running event loops and any tasks.
         
@@ -52,14 +60,47 @@ class Core(commands.Bot):
         self.config = config.config
         self.prefix = prefix
 
+        # The index of this process in the cluster and the number of processes, a standalone bot is worker 0 of 1.
+        self.worker = WORKER or (0, 1)
+
+        sharding = {}
+        if WORKER is not None:
+            sharding = {
+                "shard_count": constants.SHARD_COUNT,
+                "shard_ids": cluster.shards_for(*WORKER)
+            }
+
+        elif constants.SHARDING_ENABLED:
+            sharding = {
+                "shard_count": constants.SHARD_COUNT,
+                "shard_ids": constants.SHARD_IDS
+            }
+
         super().__init__(
             command_prefix=prefix.processor,
             owner_ids=constants.OWNER_IDS,
-            max_messages=constants.MESSAGE_CACHE_SIZE
+            max_messages=constants.MESSAGE_CACHE_SIZE,
+            **sharding
         )
 
+        self.gateway = gateway.GatewayStats(self)
+
+    def dispatch(self,
+                 event_name: str,
+                 *args, **kwargs):
+        if event_name == "socket_response":
+            self.gateway.count(args[0])
+
+        super().dispatch(event_name, *args, **kwargs)
+
     def boot(self):
-        """Plugins are loaded here just prior to initialising the gateway connection."""
+        """Plugins are loaded here just prior to initialising the gateway connection.
+        
+        When clustering is enabled this process only supervises the workers, which load plugins themselves."""
+
+        if constants.CLUSTER_WORKERS > 1 and WORKER is None:
+            self.log.info(f"Starting a cluster of {constants.CLUSTER_WORKERS} workers.")
+            return cluster.launch()
 
         self.log.debug(f"Attempting to load {len(constants.PLUGINS)} plugins.")
         for index, plugin in enumerate(constants.PLUGINS):
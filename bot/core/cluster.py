@@ -0,0 +1,94 @@
+import core.constants as constants
+import logging
+
+from os import environ
+from signal import SIGINT, SIGTERM, signal
+from subprocess import Popen
+from sys import argv, executable
+from time import monotonic, sleep
+
+# Workers are told which slice of the cluster they are through this environment variable, formatted as "index/count".
+WORKER_ENV: str = "PYCORE_WORKER"
+
+log = logging.getLogger(constants.LOGGING_NAME)
+
+def assignment() -> tuple:
+    """Returns (index, count) if this process is a cluster worker, or None if it's running standalone."""
+
+    value = environ.get(WORKER_ENV)
+    if value is None:
+        return None
+
+    index, count = value.split("/")
+    return int(index), int(count)
+
+def shards_for(index: int,
+               count: int) -> list:
+    """Splits the shards into contiguous ranges, one per worker, and returns the range belonging to a worker."""
+
+    size, extra = divmod(constants.SHARD_COUNT, count)
+    start = index * size + min(index, extra)
+
+    return list(range(start, start + size + (index < extra)))
+
+def launch():
+    """Runs the cluster, this starts a process per worker and restarts any that exit until the cluster is stopped.
+
+    Each worker runs the same entry point as this process, only with its slice of the shards."""
+
+    count = constants.CLUSTER_WORKERS
+    if constants.SHARD_COUNT is None or constants.SHARD_COUNT < count:
+        raise ValueError("SHARD_COUNT must be set to at least CLUSTER_WORKERS to run a cluster.")
+
+    workers = {}
+    stopping = False
+
+    # Maps the index of a worker that's being held back to when it's restarted, the others are still supervised meanwhile.
+    restarts = {}
+
+    def spawn(index: int):
+        env = {**environ, WORKER_ENV: f"{index}/{count}"}
+        workers[index] = Popen([executable, *argv], env=env), monotonic()
+
+        log.info(f"Started worker {index} (pid {workers[index][0].pid}) with shards {shards_for(index, count)}.")
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        restarts.clear()
+
+        for process, _ in workers.values():
+            process.send_signal(SIGINT)
+
+    signal(SIGINT, stop)
+    signal(SIGTERM, stop)
+
+    for index in range(count):
+        spawn(index)
+
+    while workers or restarts:
+        sleep(1)
+
+        for index, due in list(restarts.items()):
+            if monotonic() >= due:
+                del restarts[index]
+                spawn(index)
+
+        for index, (process, started) in list(workers.items()):
+            code = process.poll()
+            if code is None:
+                continue
+
+            del workers[index]
+            if stopping:
+                log.info(f"Worker {index} stopped.")
+                continue
+
+            # Workers that die straight after starting are held back, so a broken deploy doesn't spin.
+            if monotonic() - started < constants.CLUSTER_RESTART_DELAY:
+                log.warning(f"Worker {index} exited with code {code}, restarting it in {constants.CLUSTER_RESTART_DELAY}s.")
+                restarts[index] = monotonic() + constants.CLUSTER_RESTART_DELAY
+                continue
+
+            log.warning(f"Worker {index} exited with code {code}, restarting it.")
+            spawn(index)
\ No newline at end of file
@@ -11,6 +11,16 @@ OWNER_IDS: list = []
 # This determines how many messages Discord.py will cache before it starts removing them from cache.
 MESSAGE_CACHE_SIZE: int = 0
 
+# Sharding splits the gateway connection so that events are spread over several connections, only worth enabling in a lot of servers.
+SHARDING_ENABLED: bool = False # Whether or not AutoShardedBot is used.
+SHARD_COUNT:      int  = None # The total number of shards, None lets Discord recommend one.
+SHARD_IDS:        list = None # The shards this process connects (requires SHARD_COUNT), None connects all of them.
+
+# Clustering runs several processes (workers), each connecting its own contiguous range of the shards.
+# This requires SHARD_COUNT to be set, SHARDING_ENABLED and SHARD_IDS are ignored by workers.
+CLUSTER_WORKERS:       int   = 1 # How many worker processes are run, 1 disables clustering.
+CLUSTER_RESTART_DELAY: float = 10 # Seconds to wait before restarting a worker that died this soon after starting.
+
 # These options change how users are able to invoke commands.
 PREFIX_DEFAULT: str  = "!" # The main prefix that users are encouraged to use.
 PREFIX_ALIASES: list = [] # Any other extra prefixes that also work.
@@ -19,15 +29,24 @@ PREFIX_MENTION: bool = True # Whether or not mentioning the bot is a valid prefi
 # A list of relative paths to .py plugin files compatible with the core.
 PLUGINS: list = [
     "plugins.attach",
+    "plugins.cluster",
     "plugins.edit",
     "plugins.errors",
+    "plugins.github",
     "plugins.injectors",
+    "plugins.issues",
     "plugins.listeners",
     "plugins.lock",
     "plugins.note",
+    "plugins.outbound",
+    "plugins.outbox",
+    "plugins.poller",
     "plugins.postgres",
+    "plugins.render",
     "plugins.stances",
-    "plugins.submit"
+    "plugins.stats",
+    "plugins.submit",
+    "plugins.webhooks"
 ]
 
 # These options specify an external .py, .json, .yml or .toml file used for extra configuration.
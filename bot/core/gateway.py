@@ -0,0 +1,114 @@
+from discord.ext import commands
+from time import monotonic
+
+
+# Events whose payload is a guild, these carry the guild's ID as "id" rather than "guild_id".
+GUILD_EVENTS = frozenset(("GUILD_CREATE", "GUILD_UPDATE", "GUILD_DELETE"))
+
+class ShardCounter:
+    """Counts the events a shard receives, the rate is recalculated once per window so counting stays O(1)."""
+
+    __slots__ = ("events", "window_start", "window_events", "rate")
+
+    def __init__(self):
+        self.events: int = 0
+        self.window_start: float = monotonic()
+        self.window_events: int = 0
+        self.rate: float = 0.0
+
+    def count(self,
+              window: float):
+        self.events += 1
+        self.window_events += 1
+
+        elapsed = monotonic() - self.window_start
+        if elapsed >= window:
+            self.rate = self.window_events / elapsed
+            self.window_start = monotonic()
+            self.window_events = 0
+
+class GatewayStats:
+    """Tracks latency and event throughput per shard, plugins can reach this through bot.gateway.
+    
+    Events are attributed to shards with Discord's own formula, anything without a guild (i.e. DMs) belongs to shard 0."""
+
+    def __init__(self,
+                 bot: commands.Bot,
+                 window: float = 60):
+        self.bot = bot
+        self.window: float = window
+        self.shards: dict = {}
+
+        bot.add_listener(self.on_shard_ready)
+        bot.add_listener(self.on_shard_connect)
+        bot.add_listener(self.on_shard_disconnect)
+        bot.add_listener(self.on_shard_resumed)
+
+    @property
+    def shard_count(self) -> int:
+        return self.bot.shard_count or 1
+
+    def shard_of(self,
+                 guild_id: int) -> int:
+        """Returns the shard that a guild's events arrive on."""
+
+        if guild_id is None:
+            return 0
+
+        return (int(guild_id) >> 22) % self.shard_count
+
+    def count(self,
+              msg: dict):
+        """Counts a raw gateway payload, this is called straight from dispatch so no task is spawned per event."""
+
+        if msg.get("op") != 0:
+            return
+
+        data = msg.get("d")
+        guild_id = None
+
+        if isinstance(data, dict):
+            guild_id = data.get("id") if msg.get("t") in GUILD_EVENTS else data.get("guild_id")
+
+        shard_id = self.shard_of(guild_id)
+
+        counter = self.shards.get(shard_id)
+        if counter is None:
+            counter = self.shards[shard_id] = ShardCounter()
+
+        counter.count(self.window)
+
+    async def on_shard_ready(self,
+                             shard_id: int):
+        self.bot.log.info(f"[shard {shard_id}] Ready, {sum(1 for g in self.bot.guilds if g.shard_id == shard_id)} guilds.")
+
+    async def on_shard_connect(self,
+                               shard_id: int):
+        self.bot.log.info(f"[shard {shard_id}] Connected to the gateway.")
+
+    async def on_shard_disconnect(self,
+                                  shard_id: int):
+        self.bot.log.warn(f"[shard {shard_id}] Disconnected from the gateway.")
+
+    async def on_shard_resumed(self,
+                               shard_id: int):
+        self.bot.log.info(f"[shard {shard_id}] Resumed its session.")
+
+    def latencies(self) -> dict:
+        """Returns the heartbeat latency (in seconds) of every shard this process runs."""
+
+        if isinstance(self.bot, commands.AutoShardedBot):
+            return dict(self.bot.latencies)
+
+        return {0: self.bot.latency}
+
+    def stats(self) -> dict:
+        """Returns latency and event rates per shard, these are shown by the stats command."""
+
+        stats = {"shards": f"{len(self.latencies())}/{self.shard_count}"}
+
+        for shard_id, latency in sorted(self.latencies().items()):
+            counter = self.shards.get(shard_id) or ShardCounter()
+            stats[f"shard {shard_id}"] = f"{latency * 1000:.0f}ms, {counter.events} events, {counter.rate:.1f}/s"
+
+        return stats
\ No newline at end of file
@@ -1,4 +1,5 @@
 import core.constants as constants
+import re
 
 from discord import Message
 from discord.ext import commands
@@ -7,22 +8,39 @@ default: str  = constants.PREFIX_DEFAULT
 aliases: list = constants.PREFIX_ALIASES
 mention: bool = constants.PREFIX_MENTION
 
+# The compiled matcher for every prefix, this is built once the bot has logged in (and whenever the config is reloaded).
+pattern: re.Pattern = None
+
 def all(bot: commands.Bot) -> list:
     """Returns a list of all possible prefixes."""
 
-    return [default, *aliases] + ([bot.user.mention] if mention else [])
+    return [default, *aliases] + ([bot.user.mention] if mention and bot.user is not None else [])
+
+def compile(bot: commands.Bot) -> re.Pattern:
+    """Builds a single regex matching any prefix, longer prefixes are tried first so they aren't shadowed by shorter ones."""
+
+    global pattern
+
+    options = [re.escape(p) for p in sorted({default, *aliases}, key=len, reverse=True)]
+    if mention and bot.user is not None:
+        options.insert(0, f"<@!?{bot.user.id}>\\s*")
+
+    pattern = re.compile("|".join(options))
+    return pattern
+
+def match(bot: commands.Bot,
+          content: str) -> str:
+    """Returns the prefix the content starts with, or None if it doesn't start with one."""
+
+    if pattern is None:
+        compile(bot)
+
+    found = pattern.match(content)
+    return found.group(0) if found is not None else None
 
 def processor(bot: commands.Bot,
               msg: Message) -> callable:
     """This is what gets forwarded to command_prefix in the core."""
 
-    prefixes = aliases
-    prefixes.insert(0, default)
-    
-    if mention:
-        if isinstance(prefixes, str):
-            prefixes = prefixes,
-
-        return commands.when_mentioned_or(*prefixes)(bot, msg)
-
-    return prefixes
\ No newline at end of file
+    # Discord.py only needs the prefix that actually matched, when nothing matches the default can't match either.
+    return match(bot, msg.content) or default
\ No newline at end of file
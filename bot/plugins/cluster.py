@@ -0,0 +1,262 @@
+from asyncio import TimeoutError, wait_for
+from asyncpg import PostgresError, connect
+from discord.ext import commands, tasks
+from json import dumps, loads
+from uuid import uuid4
+
+# Workers talk to each other over this channel, the same way report changes are published.
+CLUSTER_CHANNEL = "bugbot_cluster"
+
+# Postgres refuses notification payloads of 8000 bytes or more, so replies are sent in chunks of at most this many characters.
+# Replies are ASCII JSON and escaping them again for the envelope at most doubles them, which leaves room for the rest of the envelope.
+REPLY_CHUNK = 3500
+
+# Whoever holds this advisory lock is the leader, it's released as soon as the leader's connection goes away.
+LEADER_LOCK = 0x42756743
+
+def is_leader(bot: commands.Bot) -> bool:
+    """Returns whether this process should run singleton jobs, a bot without the cluster plugin is always its own leader."""
+
+    cluster = getattr(bot, "cluster", None)
+    return cluster is None or cluster.leader
+
+class Cluster:
+    """Elects a leader for singleton jobs and lets workers ask each other things over Postgres notifications.
+
+    Every request is answered by every worker (including the one asking), so a request returns one reply per worker.
+    Replies are split over as many notifications as they need, and put back together by the worker that asked."""
+
+    def __init__(self,
+                 bot: commands.Bot,
+                 timeout: float = 3):
+        self.bot = bot
+        self.timeout: float = timeout
+
+        self.con = None
+        self.leader: bool = False
+        self.elections: int = 0
+
+        # Maps a request op to a function that returns the reply, plugins can add their own.
+        self.handlers: dict = {}
+        self.pending: dict = {}
+
+    @property
+    def workers(self) -> int:
+        return self.bot.worker[1]
+
+    async def connect(self):
+        """Opens the dedicated connection that holds the leader lock and receives requests."""
+
+        self.con = await connect(**self.bot.postgres.options)
+        await self.con.add_listener(CLUSTER_CHANNEL, self.on_notification)
+        self.con.add_termination_listener(self.on_terminate)
+
+    async def campaign(self):
+        """Tries to become the leader, this is a no-op for the current leader."""
+
+        if self.con is None or self.con.is_closed():
+            await self.connect()
+
+        if self.leader:
+            return
+
+        if await self.con.fetchval("SELECT pg_try_advisory_lock($1);", LEADER_LOCK):
+            self.leader = True
+            self.elections += 1
+
+            self.bot.log.info(f"Worker {self.bot.worker[0]} is now the cluster leader.")
+            self.bot.dispatch("leader_elected")
+
+    def on_terminate(self,
+                     con):
+        """Steps down when the connection holding the lock is lost, another worker takes over on its next campaign."""
+
+        self.con = None
+
+        if self.leader:
+            self.leader = False
+
+            self.bot.log.warn(f"Worker {self.bot.worker[0]} lost its connection and is no longer the cluster leader.")
+            self.bot.dispatch("leader_lost")
+
+    async def close(self):
+        if self.con is not None and not self.con.is_closed():
+            await self.con.close()
+
+    async def broadcast(self,
+                        op: str,
+                        **data):
+        """Sends a message to every worker."""
+
+        payload = dumps({"op": op, "worker": self.bot.worker[0], **data})
+
+        async with self.bot.postgres.acquire() as con:
+            await self.bot.queries.execute(con, "change.publish",
+                                           CLUSTER_CHANNEL, payload)
+
+    async def request(self,
+                      op: str,
+                      **data) -> list:
+        """Asks every worker something and returns their replies, workers that don't answer in time are left out."""
+
+        nonce = uuid4().hex
+        replies = []
+        done = self.bot.loop.create_future()
+
+        # Maps a worker to the chunks of its reply that have arrived so far.
+        self.pending[nonce] = replies, {}, done
+
+        try:
+            await self.broadcast(op, nonce=nonce, **data)
+            await wait_for(done, self.timeout)
+
+        except TimeoutError:
+            pass
+
+        finally:
+            del self.pending[nonce]
+
+        return sorted(replies, key=lambda r: r["worker"])
+
+    def on_notification(self,
+                        con,
+                        pid: int,
+                        channel: str,
+                        payload: str):
+        message = loads(payload)
+
+        if message["op"] == "reply":
+            pending = self.pending.get(message["nonce"])
+            if pending is None:
+                return
+
+            replies, chunks, done = pending
+            parts = chunks.setdefault(message["worker"], {})
+            parts[message["part"]] = message["chunk"]
+
+            if len(parts) < message["parts"]:
+                return
+
+            del chunks[message["worker"]]
+            replies.append({
+                "worker": message["worker"],
+                "result": loads("".join(parts[i] for i in range(message["parts"])))
+            })
+
+            if len(replies) >= self.workers and not done.done():
+                done.set_result(None)
+
+            return
+
+        handler = self.handlers.get(message["op"])
+        if handler is not None:
+            self.bot.loop.create_task(self.reply(message, handler))
+
+    async def reply(self,
+                    message: dict,
+                    handler):
+        try:
+            result = handler(message)
+
+        except Exception:
+            self.bot.log.error(f"Failed to handle cluster request {message['op']}.",
+                               exc_info=True)
+            return
+
+        result = dumps(result)
+        parts = range(0, len(result), REPLY_CHUNK)
+
+        for part, start in enumerate(parts):
+            await self.broadcast("reply", nonce=message["nonce"], part=part, parts=len(parts), chunk=result[start:start + REPLY_CHUNK])
+
+    def stats(self) -> dict:
+        """Returns the cluster state, these are shown by the stats command."""
+
+        return {
+            "worker": f"{self.bot.worker[0] + 1}/{self.workers}",
+            "leader": self.leader,
+            "elections": self.elections
+        }
+
+class Plugin(commands.Cog, name="Cluster Commands"):
+    def __init__(self,
+                 bot: commands.Bot):
+        self.bot = bot
+
+        bot.cluster.handlers["ping"] = self.ping
+        bot.cluster.handlers["dispatch"] = self.dispatch
+
+        config = bot.config.get("cluster", {})
+        self.campaign.change_interval(seconds=config.get("election_interval", 10))
+
+    def cog_unload(self):
+        self.campaign.cancel()
+        self.bot.loop.create_task(self.bot.cluster.close())
+
+    @tasks.loop(seconds=10)
+    async def campaign(self):
+        try:
+            await self.bot.cluster.campaign()
+
+        except (OSError, PostgresError):
+            self.bot.log.error("Couldn't campaign for cluster leader, retrying later.",
+                               exc_info=True)
+
+    @commands.Cog.listener()
+    async def on_postgres_ready(self):
+        if not self.campaign.is_running():
+            self.campaign.start()
+
+    def ping(self,
+             message: dict) -> dict:
+        return {
+            "shards": list(self.bot.shards) if hasattr(self.bot, "shards") else [0],
+            "guilds": len(self.bot.guilds),
+            "latency": round(self.bot.latency * 1000),
+            "leader": self.bot.cluster.leader
+        }
+
+    def dispatch(self,
+                 message: dict) -> bool:
+        self.bot.dispatch(message["event"])
+        return True
+
+    @commands.is_owner()
+    @commands.group(name="cluster",
+                    usage="cluster [dispatch <event:text>]",
+                    invoke_without_command=True)
+    async def cluster(self,
+                      ctx: commands.Context):
+        """Shows every worker in the cluster.
+
+        This is only available to owners of the bot."""
+
+        replies = await self.bot.cluster.request("ping")
+
+        lines = [f"**{len(replies)}/{self.bot.cluster.workers} workers answered**"]
+        for reply in replies:
+            result = reply["result"]
+            lines.append(f"`{reply['worker']}`{' (leader)' if result['leader'] else ''}: shards {result['shards']}, {result['guilds']} guilds, {result['latency']}ms")
+
+        await self.bot.outbound.send(ctx, "\n".join(lines))
+
+    @commands.is_owner()
+    @cluster.command(name="dispatch",
+                     usage="cluster dispatch <event:text>")
+    async def cluster_dispatch(self,
+                               ctx: commands.Context,
+                               event: str):
+        """Dispatches an event (i.e. config_reload) on every worker.
+
+        This is only available to owners of the bot."""
+
+        replies = await self.bot.cluster.request("dispatch", event=event)
+
+        await ctx.success(f"Dispatched `{event}` on {len(replies)}/{self.bot.cluster.workers} workers.",
+                          delete_after=15)
+
+def setup(bot: commands.Bot):
+    config = bot.config.get("cluster", {})
+    bot.cluster = Cluster(bot, timeout=config.get("timeout", 3))
+
+    bot.add_cog(Plugin(bot))
\ No newline at end of file
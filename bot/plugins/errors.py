@@ -1,4 +1,5 @@
 from discord.ext import commands
+from plugins.postgres import ReportConflict
 from traceback import format_tb
 
 
@@ -20,27 +21,28 @@ class Plugin(commands.Cog, name="Error Handler"):
         if isinstance(error, IGNORED):
             return
 
-        try:
-            await ctx.message.delete()
-
-        except:
-            pass
+        self.bot.outbound.discard(ctx.message)
 
         def fmt(ctx: commands.Context,
                 content: str) -> str:
             return f"{self.bot.config['emojis']['tick_no']} | {ctx.author.mention}: {content}"
 
         if isinstance(error, commands.MissingRequiredArgument):
-            return await ctx.send(fmt(ctx, f"You're missing a required argument: `{error.param.name}`"),
-                                  delete_after=15)
+            return await self.bot.outbound.send(ctx, fmt(ctx, f"You're missing a required argument: `{error.param.name}`"),
+                                                delete_after=15)
+
+        # ReportConflict is a CommandError, so discord.py raises it as is instead of wrapping it in CommandInvokeError.
+        if isinstance(error, ReportConflict):
+            return await self.bot.outbound.send(ctx, fmt(ctx, str(error)),
+                                                delete_after=15)
 
         if isinstance(error, (commands.BadArgument, commands.BadUnionArgument)):
-            return await ctx.send(fmt(ctx, f"Check the value you provided for `{list(ctx.command.clean_params)[len(ctx.args[2:] if ctx.command.cog else ctx.args[1:])]}`, it's incorrect."),
-                                  delete_after=15)
+            return await self.bot.outbound.send(ctx, fmt(ctx, f"Check the value you provided for `{list(ctx.command.clean_params)[len(ctx.args[2:] if ctx.command.cog else ctx.args[1:])]}`, it's incorrect."),
+                                                delete_after=15)
 
-        await ctx.send(fmt(ctx, "Unknown error, check the logs."),
-                       delete_after=15)
-        traceback = "\n".join(format_tb(error.original.__traceback__))
+        await self.bot.outbound.send(ctx, fmt(ctx, "Unknown error, check the logs."),
+                                     delete_after=15)
+        traceback = "\n".join(format_tb(getattr(error, "original", error).__traceback__))
         self.bot.log.error(f"Untracked error occured in {ctx.command}:\n\n{traceback}\n\n{error}")
 
                         
@@ -0,0 +1,270 @@
+from aiohttp import ClientError, ClientSession, ClientTimeout, TCPConnector
+from asyncio import Lock, TimeoutError, sleep
+from discord.ext import commands
+from random import uniform
+from time import monotonic, time
+
+
+API_BASE = "https://api.github.com"
+ISSUE_BASE = "https://github.com/{repo}/issues/{issue}"
+
+# Statuses that are worth retrying, anything else is returned to the caller as is.
+RETRY_STATUSES = frozenset((500, 502, 503, 504))
+
+# GitHub asks for at least a minute between retries of a secondary rate limit that came without Retry-After.
+SECONDARY_LIMIT_DELAY = 60
+
+class GitHubError(Exception):
+    """Raised when a request to GitHub keeps failing after every retry."""
+
+    def __init__(self,
+                 message: str,
+                 status: int = None,
+                 data = None):
+        super().__init__(message)
+
+        self.status: int = status
+        self.data = data
+
+class Response:
+    __slots__ = ("status", "headers", "data")
+
+    def __init__(self,
+                 status: int,
+                 headers,
+                 data):
+        self.status: int = status
+        self.headers = headers
+        self.data = data
+
+    @property
+    def ok(self) -> bool:
+        return 200 <= self.status < 300
+
+class RateLimit:
+    """The primary rate limit of a token, as last reported by GitHub's headers."""
+
+    __slots__ = ("limit", "remaining", "reset", "lock")
+
+    def __init__(self):
+        self.limit: int = None
+        self.remaining: int = None
+        self.reset: float = 0
+
+        # Held while a request checks and takes from the remaining count, so concurrent requests can't all pass the reserve.
+        self.lock: Lock = Lock()
+
+    def update(self,
+               headers):
+        if "X-RateLimit-Remaining" in headers:
+            self.limit = int(headers.get("X-RateLimit-Limit", 0))
+            self.remaining = int(headers["X-RateLimit-Remaining"])
+            self.reset = float(headers.get("X-RateLimit-Reset", 0))
+
+class GitHubClient:
+    """A long-lived GitHub API client shared by every plugin.
+
+    Each token gets its own pooled keep-alive session and rate limit. Requests are held back once a token gets close to its limit.
+    5xx responses and secondary rate limits are retried with exponential backoff and jitter.
+    Requests that aren't idempotent (i.e. creating an issue) are only retried after a secondary rate limit, GitHub refused those without acting on them.
+    Anything else might have gone through, so it's handed back to the caller to check."""
+
+    def __init__(self,
+                 bot: commands.Bot,
+                 retries: int = 4,
+                 backoff: float = 1,
+                 max_backoff: float = 60,
+                 reserve: int = 10,
+                 timeout: float = 15,
+                 connections: int = 10):
+        self.bot = bot
+        self.retries: int = retries
+        self.backoff: float = backoff
+        self.max_backoff: float = max_backoff
+        self.reserve: int = reserve
+        self.timeout: ClientTimeout = ClientTimeout(total=timeout)
+        self.connections: int = connections
+
+        self.sessions: dict = {}
+        self.limits: dict = {}
+
+        self.requests: int = 0
+        self.failures: int = 0
+        self.retried: int = 0
+        self.throttled: float = 0
+        self.latency_total: float = 0
+        self.latency_max: float = 0
+
+    def session(self,
+                token: str) -> ClientSession:
+        session = self.sessions.get(token)
+        if session is None or session.closed:
+            session = self.sessions[token] = ClientSession(connector=TCPConnector(limit=self.connections,
+                                                                                  keepalive_timeout=60),
+                                                           timeout=self.timeout,
+                                                           headers={
+                                                               "Authorization": f"token {token}",
+                                                               "Accept": "application/vnd.github.v3+json",
+                                                               "User-Agent": "bugbot"
+                                                           })
+
+        return session
+
+    async def throttle(self,
+                       token: str):
+        """Waits for the rate limit to reset if the token is about to run out, otherwise takes a request from what's left."""
+
+        limit = self.limits.get(token)
+        if limit is None:
+            return
+
+        async with limit.lock:
+            if limit.remaining is None:
+                return
+
+            if limit.remaining > self.reserve:
+                limit.remaining -= 1
+                return
+
+            delay = limit.reset - time()
+            if delay > 0:
+                self.throttled += delay
+                self.bot.log.warn(f"GitHub token is down to {limit.remaining} requests, waiting {delay:.0f}s for the rate limit to reset.")
+                await sleep(delay)
+
+            limit.remaining = None
+
+    def delay(self,
+              attempt: int,
+              headers = None,
+              secondary: bool = False) -> float:
+        """Returns how long to wait before a retry, Retry-After is respected if GitHub sent one.
+
+        Secondary rate limits without it wait for the primary limit to reset if that's run out, and at least a minute otherwise."""
+
+        if headers is not None and "Retry-After" in headers:
+            return float(headers["Retry-After"])
+
+        backoff = min(self.max_backoff, self.backoff * 2 ** attempt) * uniform(0.5, 1.5)
+        if not secondary:
+            return backoff
+
+        if headers is not None and headers.get("X-RateLimit-Remaining") == "0":
+            return max(SECONDARY_LIMIT_DELAY, float(headers.get("X-RateLimit-Reset", 0)) - time())
+
+        return max(SECONDARY_LIMIT_DELAY, backoff)
+
+    @staticmethod
+    def is_secondary_limit(status: int,
+                           headers,
+                           data) -> bool:
+        if status == 429:
+            return True
+
+        if status != 403:
+            return False
+
+        message = data.get("message", "") if isinstance(data, dict) else ""
+        return "Retry-After" in headers or "secondary rate limit" in message.lower()
+
+    async def request(self,
+                      method: str,
+                      path: str,
+                      token: str,
+                      idempotent: bool = True,
+                      **kwargs) -> Response:
+        """Sends a request to GitHub, retrying 5xx responses, secondary rate limits and connection errors.
+
+        Pass idempotent=False for requests that mustn't be sent twice, only secondary rate limits are retried for those."""
+
+        session = self.session(token)
+        limit = self.limits.setdefault(token, RateLimit())
+
+        for attempt in range(self.retries + 1):
+            await self.throttle(token)
+
+            self.requests += 1
+            start = monotonic()
+
+            try:
+                async with session.request(method, API_BASE + path, **kwargs) as res:
+                    data = await res.json(content_type=None) if res.status not in (204, 304) else None
+                    status, headers = res.status, res.headers
+
+            except (ClientError, TimeoutError, ValueError) as e:
+                self.failures += 1
+
+                if attempt == self.retries or not idempotent:
+                    raise GitHubError(f"{method} {path} failed: {e}") from e
+
+                self.retried += 1
+                await sleep(self.delay(attempt))
+                continue
+
+            finally:
+                latency = monotonic() - start
+                self.latency_total += latency
+                self.latency_max = max(self.latency_max, latency)
+
+            limit.update(headers)
+
+            secondary = self.is_secondary_limit(status, headers, data)
+            if status in RETRY_STATUSES or secondary:
+                self.failures += 1
+
+                if attempt == self.retries or not (idempotent or secondary):
+                    raise GitHubError(f"{method} {path} failed with {status}", status, data)
+
+                self.retried += 1
+                await sleep(self.delay(attempt, headers, secondary))
+                continue
+
+            if not 200 <= status < 400:
+                self.failures += 1
+
+            return Response(status, headers, data)
+
+    async def close(self):
+        for session in self.sessions.values():
+            await session.close()
+
+        self.sessions.clear()
+
+    def stats(self) -> dict:
+        """Returns the request counters and rate limits, these are shown by the stats command."""
+
+        stats = {
+            "requests": self.requests,
+            "failures": self.failures,
+            "retries": self.retried,
+            "throttled": f"{self.throttled:.0f}s",
+            "avg latency": f"{self.latency_total / self.requests * 1000:.0f}ms" if self.requests else "n/a",
+            "max latency": f"{self.latency_max * 1000:.0f}ms"
+        }
+
+        # Tokens are never shown, only their position.
+        for index, limit in enumerate(self.limits.values()):
+            if limit.remaining is not None:
+                stats[f"token {index}"] = f"{limit.remaining}/{limit.limit} remaining"
+
+        return stats
+
+class Plugin(commands.Cog, name="GitHub Client"):
+    def __init__(self,
+                 bot: commands.Bot):
+        self.bot = bot
+
+    def cog_unload(self):
+        self.bot.loop.create_task(self.bot.github.close())
+
+def setup(bot: commands.Bot):
+    config = bot.config.get("github", {})
+    bot.github = GitHubClient(bot,
+                              retries=config.get("retries", 4),
+                              backoff=config.get("backoff", 1),
+                              max_backoff=config.get("max_backoff", 60),
+                              reserve=config.get("reserve", 10),
+                              timeout=config.get("timeout", 15),
+                              connections=config.get("connections", 10))
+
+    bot.add_cog(Plugin(bot))
\ No newline at end of file
@@ -1,8 +1,162 @@
 import discord
 
-from discord.ext import commands
+from asyncio import Event, TimeoutError, wait_for
+from asyncpg import PostgresError
+from datetime import datetime, timedelta
+from discord.ext import commands, tasks
+from heapq import heappop, heappush
 
 
+class ExpiryScheduler:
+    """Owns the expiry of every ephemeral message (i.e. anything sent with delete_after).
+
+    A single task sleeps until the earliest expiry, then deletes everything that's due in one go, batched per channel.
+    Pending expiries are saved to Postgres so a restart still cleans up after itself.
+    In a cluster every worker only restores (and removes) the expiries of channels it can see, the rest belong to other workers."""
+
+    def __init__(self,
+                 bot: commands.Bot,
+                 stale: float = 86400):
+        self.bot = bot
+        self.stale: timedelta = timedelta(seconds=stale)
+
+        self.heap: list = []
+        self.expiries: dict = {}
+        self.wake: Event = Event()
+
+        # Changes that haven't been written to Postgres yet.
+        self.unsaved: dict = {}
+        self.expired: set = set()
+
+        self.deleted: int = 0
+        self.calls: int = 0
+        self.restored: int = 0
+
+    def schedule(self,
+                 message: discord.Message,
+                 delay: float):
+        """Deletes a message after the delay (in seconds)."""
+
+        self.add(message.id, message.channel.id, datetime.utcnow() + timedelta(seconds=delay))
+        self.unsaved[message.id] = self.expiries[message.id]
+
+    def add(self,
+            id: int,
+            channel_id: int,
+            expires_at: datetime):
+        if id in self.expiries:
+            return
+
+        self.expiries[id] = channel_id, expires_at
+        heappush(self.heap, (expires_at, id))
+
+        # The runner only needs waking if this is now the first message to expire.
+        if self.heap[0][1] == id:
+            self.wake.set()
+
+    async def run(self):
+        """Sleeps until the next expiry, this is the only task that waits on ephemeral messages."""
+
+        await self.bot.wait_until_ready()
+
+        while True:
+            self.wake.clear()
+
+            timeout = None
+            if self.heap:
+                timeout = (self.heap[0][0] - datetime.utcnow()).total_seconds()
+
+            if timeout is None or timeout > 0:
+                try:
+                    await wait_for(self.wake.wait(), timeout)
+
+                except TimeoutError:
+                    pass
+
+                continue
+
+            now = datetime.utcnow()
+            channels = {}
+
+            while self.heap and self.heap[0][0] <= now:
+                _, id = heappop(self.heap)
+                channel_id, _ = self.expiries.pop(id)
+                channels.setdefault(channel_id, []).append(id)
+
+            for channel_id, ids in channels.items():
+                self.bot.loop.create_task(self.delete(channel_id, ids))
+
+    async def delete(self,
+                     channel_id: int,
+                     ids: list):
+        channel = self.bot.get_channel(channel_id)
+        if channel is not None:
+            self.calls += await self.bot.outbound.purge(channel, [channel.get_partial_message(id) for id in ids])
+            self.deleted += len(ids)
+
+        for id in ids:
+            # Anything that expired before it was saved never needs to reach Postgres.
+            # Saved expiries in channels this process can't see are left for whoever can, or for prune.
+            if self.unsaved.pop(id, None) is None and channel is not None:
+                self.expired.add(id)
+
+    async def save(self):
+        """Writes new expiries and removes finished ones in two statements."""
+
+        if not getattr(self.bot.queries, "ready", False) or not (self.unsaved or self.expired):
+            return
+
+        unsaved, self.unsaved = self.unsaved, {}
+        expired, self.expired = self.expired, set()
+
+        try:
+            async with self.bot.postgres.acquire() as con:
+                if unsaved:
+                    await self.bot.queries.execute(con, "ephemeral.add",
+                                                   list(unsaved.keys()), [c for c, _ in unsaved.values()], [e for _, e in unsaved.values()])
+
+                if expired:
+                    await self.bot.queries.execute(con, "ephemeral.remove",
+                                                   list(expired))
+
+        except (OSError, PostgresError):
+            self.unsaved = {**unsaved, **self.unsaved}
+            self.expired |= expired
+            self.bot.log.error("Failed to save ephemeral message expiries, retrying later.",
+                               exc_info=True)
+
+    async def restore(self):
+        """Picks up every expiry that was saved before a restart, in the channels this process can see."""
+
+        # Channels are only known once every shard of this process has received its guilds.
+        await self.bot.wait_until_ready()
+
+        async with self.bot.postgres.acquire() as con:
+            rows = await self.bot.queries.fetch(con, "ephemeral.pending")
+
+        for row in rows:
+            if row["message_id"] not in self.expiries and self.bot.get_channel(row["channel_id"]) is not None:
+                self.restored += 1
+                self.add(row["message_id"], row["channel_id"], row["expires_at"])
+
+    async def prune(self):
+        """Removes saved expiries that nobody has picked up long after they were due (i.e. their channel is gone)."""
+
+        async with self.bot.postgres.acquire() as con:
+            await self.bot.queries.execute(con, "ephemeral.prune",
+                                           datetime.utcnow() - self.stale)
+
+    def stats(self) -> dict:
+        """Returns the expiry counters, these are shown by the stats command."""
+
+        return {
+            "pending": len(self.expiries),
+            "unsaved": len(self.unsaved) + len(self.expired),
+            "restored": self.restored,
+            "deleted": self.deleted,
+            "calls saved": self.deleted - self.calls
+        }
+
 class Plugin(commands.Cog, name="Context Injectors"):
     def __init__(self,
                  bot: commands.Bot):
@@ -10,10 +164,36 @@ class Plugin(commands.Cog, name="Context Injectors"):
         self.bot.add_check(self.response)
         self.bot.add_check(self.can_use)
 
+        self.runner = self.bot.loop.create_task(self.bot.expiry.run())
+
+        interval = self.bot.config.get("expiry", {}).get("save_interval", 5)
+        self.save_expiries.change_interval(seconds=interval)
+        self.save_expiries.start()
+
     def cog_unload(self):
         self.bot.remove_check(self.response)
         self.bot.remove_check(self.can_use)
 
+        self.runner.cancel()
+        self.save_expiries.cancel()
+        self.bot.loop.create_task(self.bot.expiry.save())
+
+    @tasks.loop(seconds=5)
+    async def save_expiries(self):
+        await self.bot.expiry.save()
+
+    @commands.Cog.listener()
+    async def on_postgres_ready(self):
+        await self.bot.expiry.restore()
+
+        # In a cluster only the leader prunes, see on_leader_elected.
+        if getattr(self.bot, "cluster", None) is None:
+            await self.bot.expiry.prune()
+
+    @commands.Cog.listener()
+    async def on_leader_elected(self):
+        await self.bot.expiry.prune()
+
     async def can_use(self,
                       ctx: commands.Context) -> bool:
         """Injects a function used to determine whether or not a user can run the specified command.
@@ -39,17 +219,18 @@ class Plugin(commands.Cog, name="Context Injectors"):
 
         async def success(content: str,
                           *args, **kwargs) -> discord.Message:
-            return await ctx.send(f"{self.bot.config['emojis']['tick_yes']} | {ctx.author.mention} {content}",
-                                  *args, **kwargs)
+            return await self.bot.outbound.send(ctx, f"{self.bot.config['emojis']['tick_yes']} | {ctx.author.mention} {content}",
+                                                *args, **kwargs)
 
         async def failure(content: str,
                           *args, **kwargs) -> discord.Message:
-            return await ctx.send(f"{self.bot.config['emojis']['tick_no']} | {ctx.author.mention} {content}",
-                                  *args, **kwargs)
+            return await self.bot.outbound.send(ctx, f"{self.bot.config['emojis']['tick_no']} | {ctx.author.mention} {content}",
+                                                *args, **kwargs)
 
         ctx.success = success
         ctx.failure = failure
         return True
 
 def setup(bot: commands.Bot):
+    bot.expiry = ExpiryScheduler(bot, stale=bot.config.get("expiry", {}).get("stale", 86400))
     bot.add_cog(Plugin(bot))
\ No newline at end of file
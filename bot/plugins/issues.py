@@ -0,0 +1,207 @@
+import discord
+
+from asyncio import Lock
+from asyncpg import PostgresError
+from datetime import datetime
+from discord.ext import commands, tasks
+from json import dumps
+from plugins.postgres import Report, publish_change
+from plugins.render import make_embed
+
+
+def parse_timestamp(value: str) -> datetime:
+    """Parses one of GitHub's ISO 8601 timestamps into a naive UTC datetime, like every other timestamp in the database."""
+
+    return datetime.strptime(value, "%Y-%m-%dT%H:%M:%SZ")
+
+def boards_for(bot: commands.Bot,
+               repo: str) -> list:
+    """Returns the ID of every board that files its issues in a repo, repo names aren't case sensitive on GitHub."""
+
+    repo = repo.lower()
+    return [id for id, board in bot.config["channels"]["boards"].items() if str(board.get("repo", "")).lower() == repo]
+
+class IssueSync:
+    """Writes the state of GitHub issues back to their reports, however GitHub told us about them.
+
+    Updates are collected and written in a single statement, only the latest update for each issue is kept.
+    An update older than what's already stored is ignored, GitHub doesn't promise to deliver events in order."""
+
+    def __init__(self,
+                 bot: commands.Bot,
+                 batch_size: int = 50):
+        self.bot = bot
+        self.batch_size: int = batch_size
+        self.lock: Lock = Lock()
+
+        # Maps (board ID, issue number) to (state, labels, updated at).
+        self.pending: dict = {}
+
+        self.received: int = 0
+        self.written: int = 0
+        self.changed: int = 0
+
+    def queue(self,
+              repo: str,
+              issue: dict):
+        """Queues an issue (as GitHub returns it) to be written with the next batch."""
+
+        state = issue["state"]
+        labels = dumps(sorted(label["name"] for label in issue.get("labels", ())))
+        updated_at = parse_timestamp(issue["updated_at"])
+
+        self.received += 1
+
+        for board_id in boards_for(self.bot, repo):
+            key = board_id, issue["number"]
+
+            current = self.pending.get(key)
+            if current is None or current[2] <= updated_at:
+                self.pending[key] = state, labels, updated_at
+
+        if len(self.pending) >= self.batch_size:
+            self.bot.loop.create_task(self.flush())
+
+    async def flush(self):
+        """Writes every pending update in a single statement, reports that changed are published so their board messages get edited."""
+
+        async with self.lock:
+            if not self.pending:
+                return
+
+            pending, self.pending = self.pending, {}
+            keys, values = list(pending.keys()), list(pending.values())
+
+            try:
+                async with self.bot.postgres.acquire() as con:
+                    async with con.transaction():
+                        rows = await self.bot.queries.fetch(con, "issue.sync",
+                                                            [k[0] for k in keys], [k[1] for k in keys],
+                                                            [v[0] for v in values], [v[1] for v in values], [v[2] for v in values])
+
+                        for row in rows:
+                            await publish_change(self.bot, con, row["id"], "issue_state", "issue_labels")
+
+            except (OSError, PostgresError):
+                # Anything newer that came in while this was failing takes priority.
+                self.pending = {**pending, **self.pending}
+                self.bot.log.error(f"Failed to write {len(pending)} GitHub issue updates, retrying with the next batch.",
+                                   exc_info=True)
+
+            else:
+                self.written += len(pending)
+                self.changed += len(rows)
+
+    def stats(self) -> dict:
+        """Returns the sync counters, these are shown by the stats command."""
+
+        return {
+            "pending": len(self.pending),
+            "received": self.received,
+            "written": self.written,
+            "changed reports": self.changed
+        }
+
+class BoardEditor:
+    """Re-renders bug board messages, every change to a report within a window becomes one edit.
+
+    Only the process that can see a board edits its messages, so in a cluster each edit is made exactly once."""
+
+    def __init__(self,
+                 bot: commands.Bot):
+        self.bot = bot
+        self.pending: set = set()
+
+        self.requests: int = 0
+        self.coalesced: int = 0
+        self.edits: int = 0
+        self.failures: int = 0
+
+    def schedule(self,
+                 id: int):
+        self.requests += 1
+
+        if id in self.pending:
+            self.coalesced += 1
+
+        self.pending.add(id)
+
+    async def flush(self):
+        pending, self.pending = self.pending, set()
+
+        for id in pending:
+            report = await Report.from_db(self.bot, id)
+            if report is None:
+                continue
+
+            board = report.board
+            message_id = report.raw.get("board_message_id")
+            if board is None or message_id is None:
+                continue
+
+            try:
+                await report.resolve_users()
+                await self.bot.outbound.edit(board.get_partial_message(message_id),
+                                             embed=make_embed(self.bot, report, report.issue.url or discord.Embed.Empty))
+
+            except discord.HTTPException:
+                self.failures += 1
+                self.bot.log.warn(f"Failed to edit the board message of report #{id}.",
+                                  exc_info=True)
+
+            else:
+                self.edits += 1
+
+    def stats(self) -> dict:
+        """Returns the board edit counters, these are shown by the stats command."""
+
+        return {
+            "pending": len(self.pending),
+            "requests": self.requests,
+            "edits": self.edits,
+            "coalesced": self.coalesced,
+            "failures": self.failures
+        }
+
+class Plugin(commands.Cog, name="Issue Sync"):
+    def __init__(self,
+                 bot: commands.Bot):
+        self.bot = bot
+
+        config = bot.config.get("issues", {})
+        self.flush_updates.change_interval(seconds=config.get("interval", 2))
+        self.flush_edits.change_interval(seconds=config.get("window", 5))
+
+        self.flush_updates.start()
+        self.flush_edits.start()
+
+    def cog_unload(self):
+        self.flush_updates.cancel()
+        self.flush_edits.cancel()
+
+    @tasks.loop(seconds=2)
+    async def flush_updates(self):
+        await self.bot.issues.flush()
+
+    @tasks.loop(seconds=5)
+    async def flush_edits(self):
+        await self.bot.boards.flush()
+
+    @flush_edits.before_loop
+    async def before_flush_edits(self):
+        await self.bot.wait_until_ready()
+
+    @commands.Cog.listener()
+    async def on_report_change(self,
+                               id: int,
+                               fields: list,
+                               local: bool):
+        if "issue_state" in fields or "issue_url" in fields:
+            self.bot.boards.schedule(id)
+
+def setup(bot: commands.Bot):
+    config = bot.config.get("issues", {})
+    bot.issues = IssueSync(bot, batch_size=config.get("batch_size", 50))
+    bot.boards = BoardEditor(bot)
+
+    bot.add_cog(Plugin(bot))
\ No newline at end of file
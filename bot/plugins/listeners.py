@@ -1,101 +1,115 @@
 import discord
 
-from aiohttp import ClientSession
 from datetime import datetime
 from discord.ext import commands
-from plugins.postgres import Report
+from plugins.outbound import Priority
+from plugins.postgres import Report, publish_change
+from plugins.render import extra, make_embed
 
 
-def extra(emoji: str,
-          extras: list) -> str:
-    """Formats a list of extras (i.e. approves, denies, notes and attachments) with the provided emoji."""
+class StrayCleanup:
+    """Buffers stray messages per channel and deletes them in bulk.
 
-    if not extras:
-        return "*Nothing to show.*"
+    A channel's buffer is flushed once it's full or its oldest message has waited long enough."""
 
-    return "\n".join(f"{emoji} **{e.author}**: {e.content}" for e in extras)
+    def __init__(self,
+                 bot: commands.Bot,
+                 batch_size: int = 20,
+                 delay: float = 3):
+        self.bot = bot
+        self.batch_size: int = min(batch_size, 100)
+        self.delay: float = delay
 
-def make_embed(bot: commands.Bot,
-               report: Report,
-               url: str = discord.Embed.Empty) -> discord.Embed:
-    """Creates an embed out of the info provided."""
+        self.buffers: dict = {}
+        self.timers: dict = {}
+        self.deleted: int = 0
+        self.calls: int = 0
 
-    color = bot.config["channels"]["boards"][report.board.id].get("color", 2105893)
-    if isinstance(color, str):
-        try:
-            color = int(color, 16)
-    
-        except ValueError:
-            color = 2105893
-            bot.log.warn(f"Color for board {report.board} is malformed.")
-
-    embed = discord.Embed(title=f"`🔒` {report.short}" if report.locked and report.stance != -1 else report.short,
-                          timestamp=report.created_at,
-                          color=color)
-    embed.set_author(name=f"{report.reporter} ({report.reporter.id})",
-                     icon_url=report.reporter.avatar_url,
-                     url=url)
-    embed.set_footer(text=f"Report ID: #{report.id}")
-    embed.add_field(name="Steps to reproduce",
-                    value="\n".join(f"{i+1}. {step}" for i, step in enumerate(report.steps)),
-                    inline=False)
-    embed.add_field(name="Expected result",
-                    value=report.expected,
-                    inline=False)
-    embed.add_field(name="Actual result",
-                    value=report.actual,
-                    inline=False)
-    embed.add_field(name="Software version",
-                    value=report.software,
-                    inline=False)
-
-    if report.approves:
-        embed.add_field(name="Approvals",
-                        value=extra(emoji=bot.config["emojis"]["tick_yes"],
-                                    extras=report.approves),
-                        inline=False)
-
-    if report.denies:
-        embed.add_field(name="Denials",
-                        value=extra(emoji=bot.config["emojis"]["tick_no"],
-                                    extras=report.denies),
-                        inline=False)
-
-    if report.attachments:
-        embed.add_field(name="Attachments",
-                        value=extra(emoji=":paperclip:",
-                                    extras=report.attachments),
-                        inline=False)
-
-    if report.notes:
-        embed.add_field(name="Notes",
-                        value=extra(emoji=":pencil2:",
-                                    extras=report.notes),
-                        inline=False)
-
-    return embed
+    def add(self,
+            message: discord.Message):
+        """Queues a stray message to be deleted with the rest of its channel's buffer."""
+
+        id = message.channel.id
+        buffer = self.buffers.setdefault(id, [])
+        buffer.append(message)
+
+        if len(buffer) >= self.batch_size:
+            self.bot.loop.create_task(self.flush(id))
+
+        elif id not in self.timers:
+            self.timers[id] = self.bot.loop.call_later(self.delay, lambda: self.bot.loop.create_task(self.flush(id)))
+
+    async def flush(self,
+                    id: int):
+        """Deletes everything buffered for a channel."""
+
+        timer = self.timers.pop(id, None)
+        if timer is not None:
+            timer.cancel()
+
+        messages = self.buffers.pop(id, [])
+        if not messages:
+            return
+
+        self.calls += await self.bot.outbound.purge(messages[0].channel, messages)
+        self.deleted += len(messages)
+
+    async def flush_all(self):
+        for id in list(self.buffers):
+            await self.flush(id)
+
+    def stats(self) -> dict:
+        """Returns how many deletes were batched, these are shown by the stats command."""
+
+        return {
+            "buffered": sum(len(b) for b in self.buffers.values()),
+            "deleted": self.deleted,
+            "calls": self.calls,
+            "calls saved": self.deleted - self.calls
+        }
 
 class Plugin(commands.Cog, name="General Listeners"):
     def __init__(self,
                  bot: commands.Bot):
         self.bot = bot
+        self.channels: frozenset = frozenset()
+        self.index()
+
+    def cog_unload(self):
+        self.bot.loop.create_task(self.bot.strays.flush_all())
+
+    def index(self):
+        """Rebuilds the set of channels that stray messages are removed from, along with the prefix matcher."""
+
+        channels = self.bot.config.get("channels", {})
+        self.channels = frozenset([channels["approval"], channels["denied"], *channels["boards"].keys()])
+
+        if self.bot.user is not None:
+            self.bot.prefix.compile(self.bot)
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        self.index()
+
+    @commands.Cog.listener()
+    async def on_config_reload(self):
+        """Dispatched whenever the external config has been reloaded."""
+
+        self.index()
 
     @commands.Cog.listener()
     async def on_message(self,
                          message: discord.Message):
         """This just removes stray messages from the bug channels."""
 
-        channels = self.bot.config.get("channels", {})
+        if message.channel.id not in self.channels:
+            return
 
         if not self.bot.is_ready():
             await self.bot.wait_until_ready()
 
-        if message.channel.id in [channels["approval"], channels["denied"]] + list(channels["boards"].keys()) and not message.content.startswith(tuple(self.bot.prefix.all(self.bot))) and message.author.id != self.bot.user.id:
-            try:
-                await message.delete()
-
-            except:
-                pass
+        if message.author.id != self.bot.user.id and self.bot.prefix.match(self.bot, message.content) is None:
+            self.bot.strays.add(message)
 
     @commands.Cog.listener()
     async def on_report_approve(self,
@@ -103,52 +117,30 @@ class Plugin(commands.Cog, name="General Listeners"):
                                 report: Report):
         """Dispatched whenever a report is approved."""
 
-        GH_BASE = "https://api.github.com/repos/{repo}/issues"
-        ISSUE_BASE = "https://github.com/{repo}/issues/{issue}"
+        await report.resolve_users()
 
         # Remove approval queue message
-        msg = await report.approval_message
-        await msg.delete()
-
-        fmted_steps = "\n".join(f"{i+1}. {step}" for i, step in enumerate(report.steps))
-
-        # Create issue on GitHub repository
-        board_gh = self.bot.config["channels"]["boards"].get(report.board.id)
-        if board_gh is not None:
-            async with ClientSession() as session:
-                async with session.post(url=GH_BASE.format(repo=board_gh.get("repo", "???")),
-                                        headers={
-                                            "Authorization": f"token {board_gh.get('token')}"
-                                        },
-                                        json={
-                                            "title": f"#{report.id} - {report.short}",
-                                            "body": f"**Reported by:** {report.reporter}\n\n### Short description\n{report.short}\n\n### Steps to reproduce\n{fmted_steps}\n\n### Expected result\n{report.expected}\n\n### Actual result\n{report.actual}\n\n**Software version:** {report.software}\n\n### Approvals\n{extra('✅', report.approves)}\n\n### Denials\n{extra('❌', report.denies)}\n\n### Attachments\n{extra('📌', report.attachments)}\n\n### Notes\n{extra('✏️', report.notes)}"
-                                        }) as res:
-                    if not 200 <= res.status < 300:
-                        json_res = await res.json()
-                        self.bot.log.error(f"Failed to create GitHub Issue for {GH_BASE.format(repo=board_gh.get('repo', '???'))}, reason: {res.status} - {json_res}")
-
-                    else:
-                        json_res = await res.json()
-
-                        issue_id = json_res.get("number", 0)
-                        url = ISSUE_BASE.format(repo=board_gh.get("repo", "???"),
-                                                issue=issue_id)
-
-                        async with self.bot.postgres.acquire() as con:
-                            query = """UPDATE bug_reports
-                                       SET issue_url = $1,
-                                       issue_id = $2
-                                       WHERE id = $3;"""
-
-                            await con.execute(query,
-                                              url, issue_id, report.id)
-
-        else:
-            url = "*No configured repo.*"
-
-        # Create new message in the bug board
-        await report.board.send(embed=make_embed(self.bot, report, url))
+        await report.delete_approval()
+
+        # Create new message in the bug board, the issue link is added once the outbox has created it
+        message = await self.bot.outbound.send(report.board,
+                                               embed=make_embed(self.bot, report),
+                                               priority=Priority.EDIT)
+
+        # The approval queued a board post in case this never happens, it's finished along with storing the message.
+        async with self.bot.postgres.acquire() as con:
+            async with con.transaction():
+                issue_url = await self.bot.queries.fetchval(con, "report.board_message",
+                                                            message.id, report.id)
+
+                await publish_change(self.bot, con, report.id, "board_message_id")
+
+                await self.bot.queries.execute(con, "outbox.finish",
+                                               report.id, "board.post")
+
+        # The issue was created while this was being posted, so the message has to be edited to link it.
+        if issue_url is not None:
+            self.bot.boards.schedule(report.id)
 
         # Add reward role to user
         if ctx.guild.me.guild_permissions.manage_roles:
@@ -157,18 +149,19 @@ class Plugin(commands.Cog, name="General Listeners"):
 
             if role is not None and role not in member.roles:
                 if ctx.guild.me.top_role.position > role.position:
-                    await member.add_roles(role)
+                    await self.bot.outbound.add_roles(member, role)
 
         # DM user about the approval
         try:
-            await report.reporter.send(f":tada: The bug you reported earlier (#{report.id}) has been approved! Thanks for your help!")
+            await self.bot.outbound.send(report.reporter, f":tada: The bug you reported earlier (#{report.id}) has been approved! Thanks for your help!",
+                                         priority=Priority.DM)
 
         except:
             pass
 
         # Send message confirming approval
-        await ctx.send(f"**#{report.id}** | Report has been approved for:\n{extra(self.bot.config['emojis']['tick_yes'], report.approves)}",
-                       delete_after=30)
+        await self.bot.outbound.send(ctx, f"**#{report.id}** | Report has been approved for:\n{extra(self.bot.config['emojis']['tick_yes'], report.approves)}",
+                                     delete_after=30)
 
     @commands.Cog.listener()
     async def on_report_deny(self,
@@ -176,25 +169,34 @@ class Plugin(commands.Cog, name="General Listeners"):
                              report: Report):
         """Dispatched whenever a report is denied."""
 
+        await report.resolve_users()
+
         # Remove approval queue message
-        msg = await report.approval_message
-        await msg.delete()
+        await report.delete_approval()
 
         archive = self.bot.get_channel(self.bot.config["channels"]["denied"])
         if archive is not None:
-            await archive.send(embed=make_embed(self.bot, report))
+            await self.bot.outbound.send(archive,
+                                         embed=make_embed(self.bot, report),
+                                         priority=Priority.EDIT)
 
         # DM user about the denial
         try:
-            await report.reporter.send(f":frowning: The bug you reported earlier (#{report.id}) has been denied because:\n{extra(self.bot.config['emojis']['tick_no'], report.denies)}")
+            await self.bot.outbound.send(report.reporter, f":frowning: The bug you reported earlier (#{report.id}) has been denied because:\n{extra(self.bot.config['emojis']['tick_no'], report.denies)}",
+                                         priority=Priority.DM)
 
         except:
             pass
 
         # Send message confirming denial
-        await ctx.send(f"**#{report.id}** | Report has been denied for:\n{extra(self.bot.config['emojis']['tick_no'], report.denies)}",
-                       delete_after=30)
+        await self.bot.outbound.send(ctx, f"**#{report.id}** | Report has been denied for:\n{extra(self.bot.config['emojis']['tick_no'], report.denies)}",
+                                     delete_after=30)
 
 
 def setup(bot: commands.Bot):
+    config = bot.config.get("cleanup", {})
+    bot.strays = StrayCleanup(bot,
+                              batch_size=config.get("batch_size", 20),
+                              delay=config.get("delay", 3))
+
     bot.add_cog(Plugin(bot))
\ No newline at end of file
@@ -1,73 +1,6 @@
-import discord
-
 from datetime import datetime
 from discord.ext import commands
-from plugins.postgres import Note, Report
-
-
-def extra(emoji: str,
-          extras: list) -> str:
-    """Formats a list of extras (i.e. approves, denies, notes and attachments) with the provided emoji."""
-
-    return "\n".join(f"{emoji} **{e.author}**: {e.content}" for e in extras)
-
-def make_embed(bot: commands.Bot,
-               report: Report) -> discord.Embed:
-    """Creates an embed out of the info provided."""
-
-    color = bot.config["channels"]["boards"][report.board.id].get("color", 2105893)
-    if isinstance(color, str):
-        try:
-            color = int(color, 16)
-    
-        except ValueError:
-            color = 2105893
-            bot.log.warn(f"Color for board {report.board} is malformed.")
-
-    embed = discord.Embed(title=f"`🔒` {report.short}" if report.locked else report.short,
-                          timestamp=report.created_at,
-                          color=color)
-    embed.set_author(name=f"{report.reporter} ({report.reporter.id})",
-                     icon_url=report.reporter.avatar_url)
-    embed.set_footer(text=f"Report ID: #{report.id}")
-    embed.add_field(name="Steps to reproduce",
-                    value="\n".join(f"{i+1}. {step}" for i, step in enumerate(report.steps)),
-                    inline=False)
-    embed.add_field(name="Expected result",
-                    value=report.expected,
-                    inline=False)
-    embed.add_field(name="Actual result",
-                    value=report.actual,
-                    inline=False)
-    embed.add_field(name="Software version",
-                    value=report.software,
-                    inline=False)
-
-    if report.approves:
-        embed.add_field(name="Approvals",
-                        value=extra(emoji=bot.config["emojis"]["tick_yes"],
-                                    extras=report.approves),
-                        inline=False)
-
-    if report.denies:
-        embed.add_field(name="Denials",
-                        value=extra(emoji=bot.config["emojis"]["tick_no"],
-                                    extras=report.denies),
-                        inline=False)
-
-    if report.attachments:
-        embed.add_field(name="Attachments",
-                        value=extra(emoji=":paperclip:",
-                                    extras=report.attachments),
-                        inline=False)
-
-    if report.notes:
-        embed.add_field(name="Notes",
-                        value=extra(emoji=":pencil2:",
-                                    extras=report.notes),
-                        inline=False)
-
-    return embed
+from plugins.postgres import Note, Report, compare_and_swap, is_open
 
 
 class Plugin(commands.Cog, name="Note Command"):
@@ -87,7 +20,7 @@ class Plugin(commands.Cog, name="Note Command"):
         This command only works from inside of the queue channel and does not support already approved/denied reports."""
 
         if ctx.guild.me.guild_permissions.manage_messages:
-            await ctx.message.delete()
+            self.bot.outbound.discard(ctx.message)
 
         if ctx.channel.id != self.bot.config["channels"]["approval"]:
             return await ctx.failure("This command can only be used in the approval queue.",
@@ -114,19 +47,18 @@ class Plugin(commands.Cog, name="Note Command"):
             return await ctx.failure("This report has already reached the maximum number of notes.",
                                      delete_after=15)
 
-        report.notes.append(Note(ctx.author, info))
+        def guard(report: Report) -> str:
+            if len(report.notes) >= self.bot.config["max_notes"]:
+                return "This report has already reached the maximum number of notes."
 
-        async with self.bot.postgres.acquire() as con:
-            query = """UPDATE bug_reports
-                       SET notes = $1
-                       WHERE id = $2;"""
+            return is_open(report)
 
-            await con.execute(query,
-                              str(report.notes), report.id)
+        async def write(con, version: int):
+            return await self.bot.queries.fetchval(con, "note.add",
+                                                   report.id, ctx.author.id, info, datetime.utcnow(), version, self.bot.config["max_notes"])
 
-        if await report.approval_message is None:
-            return await ctx.failure("The approval queue message no longer exists, please contact an Administrator.",
-                                     delete_after=15)
+        await compare_and_swap(self.bot, report, ("notes",), write, guard)
+        report.notes.append(Note(ctx.author, info))
 
         if report.reporter is None:
             return await ctx.failure("The user that made this report no longer exists, please contact an Administrator.",
@@ -136,9 +68,9 @@ class Plugin(commands.Cog, name="Note Command"):
             return await ctx.failure("The board for this report no longer exists, please contact an Administrator.",
                                      delete_after=15)
 
-        msg = await report.approval_message
-        await msg.edit(content=f"From: {report.board.mention}",
-                       embed=make_embed(self.bot, report))
+        if not await self.bot.renders.render(report):
+            return await ctx.failure("The approval queue message no longer exists, please contact an Administrator.",
+                                     delete_after=15)
 
         await ctx.success(f"You have added a note to report **#{report_id}**.",
                           delete_after=15)
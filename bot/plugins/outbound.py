@@ -0,0 +1,259 @@
+import discord
+
+from asyncio import CancelledError
+from datetime import datetime, timedelta
+from discord.ext import commands
+from discord.utils import snowflake_time
+from heapq import heappop, heappush
+from itertools import count
+from time import monotonic
+
+
+class Priority:
+    """The order that outbound Discord actions are let through in, lower goes first."""
+
+    EDIT = 0 # Approval queue edits, board posts and anything else moderators are waiting to see.
+    CONFIRM = 1 # Command responses.
+    CLEANUP = 2 # Deleting invocations and expired responses.
+    DM = 3 # Direct messages and role grants, nobody is watching these happen.
+
+    NAMES = ("edit", "confirm", "cleanup", "dm")
+
+# Discord refuses to bulk delete messages older than 14 days, this leaves some headroom.
+MAX_BULK_AGE = timedelta(days=14) - timedelta(minutes=5)
+
+class Limiter:
+    """Lets a limited number of holders in at once, when it's full the highest priority waiter goes next and then the earliest."""
+
+    def __init__(self,
+                 loop,
+                 limit: int):
+        self.loop = loop
+        self.slots: int = limit
+        self.limit: int = limit
+
+        self.waiters: list = []
+        self.counter = count()
+
+    async def acquire(self,
+                      priority: int):
+        """Waits for a free slot, slots are handed out by priority and then in order of arrival."""
+
+        if self.slots > 0 and not self.waiters:
+            self.slots -= 1
+            return
+
+        future = self.loop.create_future()
+        heappush(self.waiters, (priority, next(self.counter), future))
+
+        try:
+            await future
+
+        except CancelledError:
+            # The slot was handed over just as the waiter was cancelled, pass it on.
+            if future.done() and not future.cancelled():
+                self.release()
+
+            raise
+
+    def release(self):
+        """Hands a slot to the next waiter, or returns it to the pool if nobody is waiting."""
+
+        while self.waiters:
+            _, _, future = heappop(self.waiters)
+            if not future.done():
+                return future.set_result(None)
+
+        self.slots += 1
+
+    def depth(self) -> list:
+        """Returns how many are waiting at each priority."""
+
+        depth = [0] * len(Priority.NAMES)
+        for priority, _, future in self.waiters:
+            if not future.done():
+                depth[priority] += 1
+
+        return depth
+
+class Outbound:
+    """A central dispatcher that every plugin sends its Discord writes through.
+
+    Only so many actions run at once, when they're all taken the highest priority waiter goes next.
+    Each route (i.e. a channel) also has its own limit so one busy channel can't take every slot, it's handed out by priority too.
+    Otherwise queued cleanup in a channel could hold up an edit in the same channel."""
+
+    def __init__(self,
+                 bot: commands.Bot,
+                 concurrency: int = 4,
+                 route_limit: int = 2):
+        self.bot = bot
+        self.slots: Limiter = Limiter(bot.loop, concurrency)
+        self.route_limit: int = route_limit
+        self.routes: dict = {}
+
+        self.calls: list = [0] * len(Priority.NAMES)
+        self.waited: list = [0.0] * len(Priority.NAMES)
+        self.longest: list = [0.0] * len(Priority.NAMES)
+        self.failures: int = 0
+
+    async def call(self,
+                   priority: int,
+                   route,
+                   func,
+                   *args, **kwargs):
+        """Runs a Discord call once both its route and a slot are free."""
+
+        entry = self.routes.get(route)
+        if entry is None:
+            entry = self.routes[route] = [Limiter(self.bot.loop, self.route_limit), 0]
+
+        entry[1] += 1
+        start = monotonic()
+
+        try:
+            await entry[0].acquire(priority)
+
+            try:
+                await self.slots.acquire(priority)
+
+                waited = monotonic() - start
+                self.calls[priority] += 1
+                self.waited[priority] += waited
+                self.longest[priority] = max(self.longest[priority], waited)
+
+                try:
+                    return await func(*args, **kwargs)
+
+                except discord.HTTPException:
+                    self.failures += 1
+                    raise
+
+                finally:
+                    self.slots.release()
+
+            finally:
+                entry[0].release()
+
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self.routes[route]
+
+    @staticmethod
+    def route(target) -> int:
+        """Returns the route a target's calls are limited by, this is the channel (or user for DMs) it belongs to."""
+
+        channel = getattr(target, "channel", target)
+        return getattr(channel, "id", None)
+
+    async def send(self,
+                   destination: discord.abc.Messageable,
+                   *args,
+                   priority: int = Priority.CONFIRM,
+                   delete_after: float = None,
+                   **kwargs) -> discord.Message:
+        message = await self.call(priority, self.route(destination), destination.send, *args, **kwargs)
+
+        if delete_after is not None:
+            self.bot.expiry.schedule(message, delete_after)
+
+        return message
+
+    async def edit(self,
+                   message: discord.Message,
+                   priority: int = Priority.EDIT,
+                   **fields) -> discord.Message:
+        return await self.call(priority, self.route(message), message.edit, **fields)
+
+    async def delete(self,
+                     message: discord.Message,
+                     priority: int = Priority.CLEANUP):
+        return await self.call(priority, self.route(message), message.delete)
+
+    async def bulk_delete(self,
+                          channel: discord.TextChannel,
+                          messages: list,
+                          priority: int = Priority.CLEANUP):
+        return await self.call(priority, self.route(channel), channel.delete_messages, messages)
+
+    async def add_roles(self,
+                        member: discord.Member,
+                        *roles: discord.Role,
+                        priority: int = Priority.DM):
+        return await self.call(priority, ("roles", member.guild.id), member.add_roles, *roles)
+
+    async def purge(self,
+                    channel: discord.abc.Messageable,
+                    messages: list,
+                    priority: int = Priority.CLEANUP) -> int:
+        """Deletes messages from a channel in as few calls as possible, returns how many calls it took.
+        
+        Messages too old to bulk delete (or a bulk delete that fails) fall back to single deletes."""
+
+        cutoff = datetime.utcnow() - MAX_BULK_AGE
+
+        recent = [m for m in messages if snowflake_time(m.id) > cutoff]
+        single = [m for m in messages if snowflake_time(m.id) <= cutoff]
+        calls = 0
+
+        if len(recent) > 1 and isinstance(channel, discord.TextChannel) and channel.permissions_for(channel.guild.me).manage_messages:
+            for i in range(0, len(recent), 100):
+                chunk = recent[i:i + 100]
+
+                try:
+                    calls += 1
+                    await self.bulk_delete(channel, chunk, priority)
+
+                except discord.HTTPException:
+                    single.extend(chunk)
+
+        else:
+            single.extend(recent)
+
+        for message in single:
+            calls += 1
+            self.discard(message)
+
+        return calls
+
+    def discard(self,
+                message: discord.Message):
+        """Deletes a message in the background without holding up the caller, a message that's already gone is ignored."""
+
+        async def _():
+            try:
+                await self.delete(message)
+
+            except discord.HTTPException:
+                pass
+
+        self.bot.loop.create_task(_())
+
+    def stats(self) -> dict:
+        """Returns the queue depth and wait times per priority, these are shown by the stats command."""
+
+        depth = self.slots.depth()
+        for limiter, _ in self.routes.values():
+            depth = [a + b for a, b in zip(depth, limiter.depth())]
+
+        stats = {
+            "slots": f"{self.slots.limit - self.slots.slots}/{self.slots.limit}",
+            "routes": len(self.routes),
+            "failures": self.failures
+        }
+
+        for priority, name in enumerate(Priority.NAMES):
+            calls = self.calls[priority]
+            average = self.waited[priority] / calls if calls else 0
+
+            stats[name] = f"{depth[priority]} queued, {calls} sent, {average * 1000:.0f}ms avg wait, {self.longest[priority] * 1000:.0f}ms max wait"
+
+        return stats
+
+def setup(bot: commands.Bot):
+    config = bot.config.get("outbound", {})
+
+    bot.outbound = Outbound(bot,
+                            concurrency=config.get("concurrency", 4),
+                            route_limit=config.get("route_limit", 2))
\ No newline at end of file
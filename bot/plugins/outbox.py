@@ -0,0 +1,581 @@
+import discord
+
+from asyncio import Event, TimeoutError, gather, sleep, wait_for
+from asyncpg import PostgresError
+from datetime import datetime, timedelta
+from discord.ext import commands
+from plugins.cluster import is_leader
+from plugins.github import ISSUE_BASE, GitHubError
+from plugins.outbound import Priority
+from plugins.postgres import Report, publish_change
+from plugins.render import extra, make_embed
+
+
+# Every issue body carries this marker (and every title the report's ID), so an issue created by an attempt that crashed before it was recorded can be found again.
+MARKER = "<!-- bugbot:report:{id} -->"
+
+def issue_body(report: Report) -> str:
+    """Formats a report as the body of a GitHub issue."""
+
+    steps = "\n".join(f"{i+1}. {step}" for i, step in enumerate(report.steps))
+
+    return f"**Reported by:** {report.reporter}\n\n### Short description\n{report.short}\n\n### Steps to reproduce\n{steps}\n\n### Expected result\n{report.expected}\n\n### Actual result\n{report.actual}\n\n**Software version:** {report.software}\n\n### Approvals\n{extra('✅', report.approves)}\n\n### Denials\n{extra('❌', report.denies)}\n\n### Attachments\n{extra('📌', report.attachments)}\n\n### Notes\n{extra('✏️', report.notes)}\n\n{MARKER.format(id=report.id)}"
+
+def issue_title(report: Report) -> str:
+    return f"#{report.id} - {report.short}"
+
+def is_permanent(error: Exception) -> bool:
+    """Returns whether a job failed in a way that retrying won't fix, 4xx responses (other than rate limits) fail the same way every time."""
+
+    status = getattr(error, "status", None)
+    return status is not None and 400 <= status < 500 and status not in (403, 429)
+
+class Progress:
+    """A message in the approval queue showing how far a repo's backlog of issues has got."""
+
+    __slots__ = ("message", "created", "failed", "total")
+
+    def __init__(self):
+        self.message = None
+        self.created: int = 0
+        self.failed: int = 0
+        self.total: int = 0
+
+    def __str__(self) -> str:
+        failed = f", {self.failed} failed" if self.failed else ""
+        return f"{self.created}/{self.total} issues created{failed}"
+
+class Outbox:
+    """Drains the github_outbox table, this is how anything that has to reach GitHub gets there without blocking a command.
+
+    Jobs are claimed with SKIP LOCKED and leased, so a job is never run twice even while the leader changes hands.
+    Claimed jobs are grouped by kind and repo, issues for the same repo are created in batches (one GraphQL request each, if enabled) at a steady pace.
+    A failed job is retried with backoff until it runs out of attempts, a job GitHub rejects outright is abandoned straight away."""
+
+    def __init__(self,
+                 bot: commands.Bot,
+                 batch_size: int = 10,
+                 interval: float = 30,
+                 lease: float = 300,
+                 backoff: float = 30,
+                 max_attempts: int = 8,
+                 pace: float = 3,
+                 graphql: bool = True,
+                 progress: int = 10,
+                 max_pages: int = 10):
+        self.bot = bot
+        self.batch_size: int = batch_size
+        self.interval: float = interval
+        self.lease: timedelta = timedelta(seconds=lease)
+        self.backoff: float = backoff
+        self.max_attempts: int = max_attempts
+        self.pace: float = pace
+        self.graphql: bool = graphql
+        self.progress_threshold: int = progress
+        self.max_pages: int = max_pages
+        self.wake: Event = Event()
+
+        # Maps a job kind to the coroutine function that runs a batch of its jobs for a repo.
+        # Handlers return the jobs that failed, mapped to the exception they failed with.
+        self.handlers: dict = {
+            "board.post": self.post_boards,
+            "issue.create": self.create_issues
+        }
+
+        # When each repo may next have an issue created in it, in loop time.
+        self.next_at: dict = {}
+        self.repository_ids: dict = {}
+        self.logins: dict = {}
+        self.progress: dict = {}
+
+        self.completed: int = 0
+        self.retried: int = 0
+        self.abandoned: int = 0
+        self.recovered: int = 0
+        self.batches: int = 0
+        self.paced: float = 0
+
+    def approval_jobs(self,
+                      report: Report) -> tuple:
+        """Returns what the cast_stance function needs to queue an approved report's jobs in the same statement as the approval.
+
+        That's when the board post may run and the repo to create the issue in (if the board has one).
+        The board post is held back for a lease, the approving command posts it straight away and finishes the job itself.
+        It only runs from here if that never happened (i.e. Discord failed or the process died)."""
+
+        board = self.bot.config["channels"]["boards"].get(report.raw.get("board_id"), {})
+        return datetime.utcnow() + self.lease, board.get("repo")
+
+    def notify(self):
+        self.wake.set()
+
+    async def run(self):
+        """Drains the outbox whenever a job is added, and every interval in case another worker added one.
+
+        Only the cluster leader drains it, issues for a repo have to be paced from a single place."""
+
+        await self.bot.wait_until_ready()
+
+        while True:
+            self.wake.clear()
+
+            try:
+                if is_leader(self.bot):
+                    await self.drain()
+
+            except (OSError, PostgresError):
+                self.bot.log.error("Failed to drain the GitHub outbox, retrying later.",
+                                   exc_info=True)
+
+            try:
+                await wait_for(self.wake.wait(), self.interval)
+
+            except TimeoutError:
+                pass
+
+    async def drain(self):
+        while True:
+            now = datetime.utcnow()
+
+            async with self.bot.postgres.acquire() as con:
+                jobs = await self.bot.queries.fetch(con, "outbox.claim",
+                                                    now, now + self.lease, self.batch_size)
+
+            if not jobs:
+                return
+
+            groups = {}
+            for job in jobs:
+                groups.setdefault((job["kind"], job["repo"]), []).append(job)
+
+            await gather(*(self.process(kind, repo, jobs) for (kind, repo), jobs in groups.items()))
+
+    async def process(self,
+                      kind: str,
+                      repo: str,
+                      jobs: list):
+        try:
+            failed = await self.handlers[kind](repo, jobs)
+
+        except Exception as e:
+            if not isinstance(e, GitHubError):
+                self.bot.log.error(f"Outbox batch of {len(jobs)} {kind} jobs for {repo} failed.",
+                                   exc_info=True)
+
+            failed = {job["id"]: e for job in jobs}
+
+        for job in jobs:
+            error = failed.get(job["id"])
+            if error is not None:
+                await self.fail(job, error)
+                continue
+
+            self.completed += 1
+
+            async with self.bot.postgres.acquire() as con:
+                await self.bot.queries.execute(con, "outbox.done",
+                                               job["id"])
+
+    async def fail(self,
+                   job,
+                   error: Exception):
+        message = str(error) if isinstance(error, GitHubError) else repr(error)
+
+        async with self.bot.postgres.acquire() as con:
+            if is_permanent(error) or job["attempts"] >= self.max_attempts:
+                self.abandoned += 1
+                self.bot.log.error(f"Gave up on outbox job #{job['id']} ({job['kind']}) for report #{job['report_id']}: {message}")
+
+                return await self.bot.queries.execute(con, "outbox.abandon",
+                                                      job["id"], message)
+
+            self.retried += 1
+            delay = self.backoff * 2 ** (job["attempts"] - 1)
+
+            await self.bot.queries.execute(con, "outbox.retry",
+                                           job["id"], datetime.utcnow() + timedelta(seconds=delay), message)
+
+    async def wait_turn(self,
+                        repo: str,
+                        count: int):
+        """Waits until a repo can take more issues, then books the time that count issues take.
+
+        GitHub's secondary rate limit on content creation is enforced per account, pacing keeps a backlog well under it."""
+
+        now = self.bot.loop.time()
+        start = max(now, self.next_at.get(repo, 0))
+        self.next_at[repo] = start + count * self.pace
+
+        if start > now:
+            self.paced += start - now
+            await sleep(start - now)
+
+    async def login(self,
+                    token: str) -> str:
+        """Returns the login of the account a token belongs to, or None if GitHub won't say (i.e. app installation tokens)."""
+
+        if token not in self.logins:
+            res = await self.bot.github.request("GET", "/user", token)
+            self.logins[token] = res.data.get("login") if res.ok else None
+
+        return self.logins[token]
+
+    async def find_issues(self,
+                          repo: str,
+                          token: str,
+                          reports: list,
+                          since: datetime) -> dict:
+        """Looks for issues that earlier attempts created, returns each report's ID mapped to the number of the issue found for it.
+
+        This lists the repo's issues rather than searching, the search index lags behind and doesn't reliably index the body marker.
+        Only issues opened by the bot's account and touched since the first job was queued are listed, matched by title prefix or marker."""
+
+        wanted = {report.id: (f"#{report.id} - ", MARKER.format(id=report.id)) for report in reports}
+        found = {}
+
+        params = {
+            "state": "all",
+            "sort": "created",
+            "direction": "desc",
+            "since": since.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "per_page": 100
+        }
+
+        creator = await self.login(token)
+        if creator is not None:
+            params["creator"] = creator
+
+        for page in range(1, self.max_pages + 1):
+            res = await self.bot.github.request("GET", f"/repos/{repo}/issues", token,
+                                                params={**params, "page": page})
+
+            if not res.ok:
+                raise GitHubError(f"Failed to list the issues of {repo}, reason: {res.status} - {res.data}", res.status, res.data)
+
+            for issue in res.data:
+                for id, (prefix, marker) in wanted.items():
+                    if id not in found and (issue.get("title", "").startswith(prefix) or marker in (issue.get("body") or "")):
+                        found[id] = issue["number"]
+
+            if len(found) == len(wanted) or len(res.data) < params["per_page"]:
+                break
+
+        return found
+
+    async def graphql(self,
+                      token: str,
+                      query: str,
+                      idempotent: bool = True,
+                      **variables) -> dict:
+        res = await self.bot.github.request("POST", "/graphql", token,
+                                            idempotent=idempotent,
+                                            json={
+                                                "query": query,
+                                                "variables": variables
+                                            })
+
+        if not res.ok:
+            raise GitHubError(f"GraphQL request failed, reason: {res.status} - {res.data}", res.status, res.data)
+
+        return res.data
+
+    async def repository_id(self,
+                            repo: str,
+                            token: str) -> str:
+        """Returns the GraphQL node ID of a repo, these never change so they're only looked up once."""
+
+        id = self.repository_ids.get(repo)
+        if id is None:
+            owner, name = repo.split("/", 1)
+            data = await self.graphql(token, "query($owner: String!, $name: String!) { repository(owner: $owner, name: $name) { id } }",
+                                      owner=owner,
+                                      name=name)
+
+            repository = (data.get("data") or {}).get("repository")
+            if repository is None:
+                raise GitHubError(f"Couldn't find the repository {repo}, reason: {data.get('errors')}", 404, data)
+
+            id = self.repository_ids[repo] = repository["id"]
+
+        return id
+
+    async def create_rest(self,
+                          repo: str,
+                          token: str,
+                          report: Report) -> int:
+        res = await self.bot.github.request("POST", f"/repos/{repo}/issues", token,
+                                            idempotent=False,
+                                            json={
+                                                "title": issue_title(report),
+                                                "body": issue_body(report)
+                                            })
+
+        if not res.ok:
+            raise GitHubError(f"Failed to create GitHub Issue for {repo}, reason: {res.status} - {res.data}", res.status, res.data)
+
+        return res.data["number"]
+
+    async def create_graphql(self,
+                             repo: str,
+                             token: str,
+                             reports: list) -> dict:
+        """Creates several issues in one request with aliased createIssue mutations.
+
+        Returns each report's ID mapped to its issue number, or to the exception it failed with."""
+
+        variables = {"repo": await self.repository_id(repo, token)}
+        params, mutations = ["$repo: ID!"], []
+
+        for i, report in enumerate(reports):
+            variables[f"t{i}"], variables[f"b{i}"] = issue_title(report), issue_body(report)
+            params.append(f"$t{i}: String!, $b{i}: String!")
+            mutations.append(f"i{i}: createIssue(input: {{repositoryId: $repo, title: $t{i}, body: $b{i}}}) {{ issue {{ number }} }}")
+
+        data = await self.graphql(token, f"mutation({', '.join(params)}) {{ {' '.join(mutations)} }}",
+                                  idempotent=False,
+                                  **variables)
+
+        created = data.get("data") or {}
+        errors = {}
+        for error in data.get("errors") or ():
+            path = error.get("path") or ()
+            if path:
+                errors[path[0]] = error.get("message")
+
+        results = {}
+        for i, report in enumerate(reports):
+            result = created.get(f"i{i}")
+            if result is not None and result.get("issue") is not None:
+                results[report.id] = result["issue"]["number"]
+
+            else:
+                results[report.id] = GitHubError(f"Failed to create GitHub Issue for {repo}, reason: {errors.get(f'i{i}', data.get('errors'))}")
+
+        return results
+
+    async def create_issues(self,
+                            repo: str,
+                            jobs: list) -> dict:
+        """Creates the issues for a batch of reports in the same repo, and reports progress if the backlog is large."""
+
+        reports = await gather(*(Report.from_db(self.bot, job["report_id"], cached=False) for job in jobs))
+        failed, pending = {}, []
+
+        for job, report in zip(jobs, reports):
+            # Deleted reports and reports that already have an issue are done.
+            if report is not None and report.raw.get("issue_id") is None:
+                pending.append((job, report))
+
+        if not pending:
+            return failed
+
+        board = self.bot.config["channels"]["boards"].get(pending[0][1].raw.get("board_id"), {})
+        token = board.get("token")
+
+        await gather(*(report.resolve_users() for _, report in pending))
+
+        # Only a retry can have created the issue already, the client never re-sends a create within an attempt.
+        retries = [(job, report) for job, report in pending if job["attempts"] > 1]
+        found = {}
+        if retries:
+            found = await self.find_issues(repo, token, [report for _, report in retries], min(job["created_at"] for job, _ in retries))
+
+        to_create = []
+        for job, report in pending:
+            if report.id in found:
+                self.recovered += 1
+                await self.backfill(report, repo, found[report.id])
+
+            else:
+                to_create.append((job, report))
+
+        if not to_create:
+            return failed
+
+        progress = await self.start_progress(repo, len(to_create))
+
+        await self.wait_turn(repo, len(to_create))
+        self.batches += 1
+
+        if self.graphql and len(to_create) > 1:
+            results = await self.create_graphql(repo, token, [report for _, report in to_create])
+
+        else:
+            results = {}
+            for _, report in to_create:
+                try:
+                    results[report.id] = await self.create_rest(repo, token, report)
+
+                except GitHubError as e:
+                    results[report.id] = e
+
+        for job, report in to_create:
+            result = results[report.id]
+            if isinstance(result, Exception):
+                failed[job["id"]] = result
+                continue
+
+            try:
+                await self.backfill(report, repo, result)
+
+            except Exception as e:
+                # The issue exists, a retry finds it by its marker and only redoes the backfill.
+                failed[job["id"]] = e
+
+        if progress is not None:
+            await self.update_progress(repo, progress, len(to_create) - len(failed), len(failed), len(jobs))
+
+        return failed
+
+    async def start_progress(self,
+                             repo: str,
+                             count: int) -> Progress:
+        """Returns the progress of a repo's backlog, a message is only posted once the backlog is large enough to be worth following."""
+
+        progress = self.progress.get(repo)
+        if progress is not None:
+            return progress
+
+        async with self.bot.postgres.acquire() as con:
+            total = await self.bot.queries.fetchval(con, "outbox.remaining",
+                                                    "issue.create", repo)
+
+        if max(total, count) < self.progress_threshold:
+            return None
+
+        queue = self.bot.get_channel(self.bot.config["channels"]["approval"])
+        if queue is None:
+            return None
+
+        progress = self.progress[repo] = Progress()
+        progress.total = max(total, count)
+        progress.message = await self.bot.outbound.send(queue, f"Creating GitHub issues for `{repo}`: {progress}",
+                                                        priority=Priority.CONFIRM)
+
+        return progress
+
+    async def update_progress(self,
+                              repo: str,
+                              progress: Progress,
+                              created: int,
+                              failed: int,
+                              claimed: int):
+        progress.created += created
+        progress.failed += failed
+
+        # The batch's own jobs are only removed once this returns.
+        async with self.bot.postgres.acquire() as con:
+            remaining = await self.bot.queries.fetchval(con, "outbox.remaining",
+                                                        "issue.create", repo) - claimed
+
+        # Reports approved while the backlog is being worked through join it.
+        progress.total = max(progress.total, progress.created + progress.failed + remaining)
+
+        if remaining == 0 or progress.created + progress.failed >= progress.total:
+            del self.progress[repo]
+            content = f"Finished creating GitHub issues for `{repo}`: {progress}"
+
+        else:
+            content = f"Creating GitHub issues for `{repo}`: {progress}"
+
+        await self.bot.outbound.edit(progress.message,
+                                     priority=Priority.CONFIRM,
+                                     content=content)
+
+    async def post_boards(self,
+                          repo: str,
+                          jobs: list) -> dict:
+        """Posts the board messages that approving reports didn't manage to.
+
+        These go through the HTTP client by channel ID, the leader doesn't have to be able to see the board."""
+
+        failed = {}
+
+        for job in jobs:
+            report = await Report.from_db(self.bot, job["report_id"], cached=False)
+            if report is None or report.raw.get("board_message_id") is not None:
+                continue
+
+            board_id = report.raw.get("board_id")
+
+            try:
+                await report.resolve_users()
+                data = await self.bot.outbound.call(Priority.EDIT, board_id, self.bot.http.send_message, board_id, None,
+                                                    embed=make_embed(self.bot, report, report.issue.url or discord.Embed.Empty).to_dict())
+
+                async with self.bot.postgres.acquire() as con:
+                    issue_url = await self.bot.queries.fetchval(con, "report.board_message",
+                                                                int(data["id"]), report.id)
+
+                    await publish_change(self.bot, con, report.id, "board_message_id")
+
+                # The issue was created while this was being posted.
+                if issue_url != report.issue.url:
+                    self.bot.boards.schedule(report.id)
+
+            except (discord.HTTPException, OSError, PostgresError) as e:
+                failed[job["id"]] = e
+
+        return failed
+
+    async def backfill(self,
+                       report: Report,
+                       repo: str,
+                       number: int):
+        """Records the issue on the report, the worker that can see the board edits its message to link it."""
+
+        url = ISSUE_BASE.format(repo=repo,
+                                issue=number)
+
+        async with self.bot.postgres.acquire() as con:
+            await self.bot.queries.execute(con, "report.issue",
+                                           url, number, report.id)
+
+            await publish_change(self.bot, con, report.id, "issue_url", "issue_id")
+
+    def stats(self) -> dict:
+        """Returns the outbox counters, these are shown by the stats command."""
+
+        return {
+            "completed": self.completed,
+            "retried": self.retried,
+            "abandoned": self.abandoned,
+            "found after a crash": self.recovered,
+            "batches": self.batches,
+            "paced": f"{self.paced:.0f}s",
+            "backlogs": len(self.progress)
+        }
+
+class Plugin(commands.Cog, name="GitHub Outbox"):
+    def __init__(self,
+                 bot: commands.Bot):
+        self.bot = bot
+        self.runner = None
+
+    def cog_unload(self):
+        if self.runner is not None:
+            self.runner.cancel()
+
+    @commands.Cog.listener()
+    async def on_postgres_ready(self):
+        if self.runner is None:
+            self.runner = self.bot.loop.create_task(self.bot.outbox.run())
+
+    @commands.Cog.listener()
+    async def on_leader_elected(self):
+        self.bot.outbox.notify()
+
+def setup(bot: commands.Bot):
+    config = bot.config.get("outbox", {})
+    bot.outbox = Outbox(bot,
+                        batch_size=config.get("batch_size", 10),
+                        interval=config.get("interval", 30),
+                        lease=config.get("lease", 300),
+                        backoff=config.get("backoff", 30),
+                        max_attempts=config.get("max_attempts", 8),
+                        pace=config.get("pace", 3),
+                        graphql=config.get("graphql", True),
+                        progress=config.get("progress", 10),
+                        max_pages=config.get("max_pages", 10))
+
+    bot.add_cog(Plugin(bot))
\ No newline at end of file
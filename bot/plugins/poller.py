@@ -0,0 +1,189 @@
+from asyncpg import PostgresError
+from datetime import datetime
+from discord.ext import commands, tasks
+from plugins.cluster import is_leader
+from plugins.github import GitHubError
+from plugins.issues import parse_timestamp
+
+
+class SyncState:
+    """Where the last poll of a repo left off."""
+
+    __slots__ = ("etag", "since", "due")
+
+    def __init__(self,
+                 etag: str = None,
+                 since: datetime = None):
+        self.etag: str = etag
+        self.since: datetime = since
+        self.due: float = 0
+
+class IssuePoller:
+    """Polls the issues of repos that can't send webhooks, for boards that set a poll interval.
+
+    Each poll lists the issues updated since the last one. The request carries the ETag of the previous response, so an unchanged repo gets a 304.
+    GitHub doesn't count a 304 against the rate limit."""
+
+    def __init__(self,
+                 bot: commands.Bot,
+                 max_pages: int = 5):
+        self.bot = bot
+        self.max_pages: int = max_pages
+
+        # Maps a repo (lowercased) to its SyncState, loaded from the database on the first poll.
+        self.states: dict = None
+
+        self.polls: int = 0
+        self.not_modified: int = 0
+        self.pages: int = 0
+        self.issues: int = 0
+        self.failures: int = 0
+
+    def repos(self) -> dict:
+        """Returns every polled repo with its interval, token and whether ETags are used, the shortest interval of any board wins."""
+
+        repos = {}
+        for board in self.bot.config["channels"]["boards"].values():
+            if board.get("poll") is None or board.get("repo") is None:
+                continue
+
+            repo = board["repo"].lower()
+            current = repos.get(repo)
+            if current is None or board["poll"] < current[0]:
+                repos[repo] = board["poll"], board.get("token"), board.get("etag", True)
+
+        return repos
+
+    async def load(self):
+        async with self.bot.postgres.acquire() as con:
+            rows = await self.bot.queries.fetch(con, "sync.get")
+
+        self.states = {row["repo"]: SyncState(row["etag"], row["since"]) for row in rows}
+
+    async def poll_due(self,
+                       now: float):
+        """Polls every repo whose interval has passed."""
+
+        if self.states is None:
+            await self.load()
+
+        for repo, (interval, token, etag) in self.repos().items():
+            state = self.states.setdefault(repo, SyncState())
+            if state.due > now:
+                continue
+
+            state.due = now + interval
+
+            try:
+                await self.poll(repo, token, state, etag)
+
+            except (GitHubError, OSError, PostgresError) as e:
+                self.failures += 1
+                self.bot.log.error(f"Failed to poll the issues of {repo}, reason: {e}")
+
+    async def poll(self,
+                   repo: str,
+                   token: str,
+                   state: SyncState,
+                   use_etag: bool = True):
+        """Lists the issues of a repo updated since the last poll and writes their state back in one batch."""
+
+        self.polls += 1
+
+        params = {
+            "state": "all",
+            "sort": "updated",
+            "direction": "asc",
+            "per_page": 100
+        }
+
+        if state.since is not None:
+            params["since"] = state.since.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+        since, etag = state.since, None
+
+        for page in range(1, self.max_pages + 1):
+            headers = {}
+            if page == 1 and use_etag and state.etag is not None:
+                headers["If-None-Match"] = state.etag
+
+            res = await self.bot.github.request("GET", f"/repos/{repo}/issues", token,
+                                                params={**params, "page": page},
+                                                headers=headers)
+
+            if res.status == 304:
+                self.not_modified += 1
+                return
+
+            if not res.ok:
+                raise GitHubError(f"{res.status} - {res.data}", res.status, res.data)
+
+            self.pages += 1
+            if page == 1:
+                etag = res.headers.get("ETag")
+
+            for issue in res.data:
+                # Pull requests are listed as issues, reports never become pull requests.
+                if "pull_request" in issue:
+                    continue
+
+                self.issues += 1
+                self.bot.issues.queue(repo, issue)
+                since = max(since or datetime.min, parse_timestamp(issue["updated_at"]))
+
+            if len(res.data) < params["per_page"]:
+                break
+
+        await self.bot.issues.flush()
+
+        # The since value is inclusive, so the next poll sees the last issue again and the ETag stays valid until something else changes.
+        # An ETag is only kept for a request that will be repeated as is, a poll that moved since asks for a new one next time.
+        state.etag = etag if since == state.since else None
+        state.since = since
+
+        async with self.bot.postgres.acquire() as con:
+            await self.bot.queries.execute(con, "sync.save",
+                                           repo, state.etag, state.since, datetime.utcnow())
+
+    def stats(self) -> dict:
+        """Returns the poll counters, these are shown by the stats command."""
+
+        return {
+            "repos": len(self.repos()),
+            "polls": self.polls,
+            "not modified": self.not_modified,
+            "pages": self.pages,
+            "issues": self.issues,
+            "failures": self.failures
+        }
+
+class Plugin(commands.Cog, name="Issue Poller"):
+    def __init__(self,
+                 bot: commands.Bot):
+        self.bot = bot
+
+        config = bot.config.get("poller", {})
+        self.tick.change_interval(seconds=config.get("tick", 15))
+
+    def cog_unload(self):
+        self.tick.cancel()
+
+    @tasks.loop(seconds=15)
+    async def tick(self):
+        """Polls any repo that's due, this only runs on the cluster leader so every repo is polled once."""
+
+        if not is_leader(self.bot):
+            return
+
+        await self.bot.poller.poll_due(self.bot.loop.time())
+
+    @commands.Cog.listener()
+    async def on_postgres_ready(self):
+        if not self.tick.is_running():
+            self.tick.start()
+
+def setup(bot: commands.Bot):
+    config = bot.config.get("poller", {})
+    bot.poller = IssuePoller(bot, max_pages=config.get("max_pages", 5))
+
+    bot.add_cog(Plugin(bot))
\ No newline at end of file
@@ -3,61 +3,491 @@
 import discord
 
 from ast import literal_eval
-from asyncpg import connect, create_pool
-from datetime import datetime
+from asyncio import CancelledError, Semaphore, TimeoutError, gather, sleep, wait_for
+from asyncpg import InvalidCachedStatementError, PostgresError, connect, create_pool
+from collections import OrderedDict
+from contextlib import AsyncExitStack, asynccontextmanager
+from datetime import datetime, timedelta
 from discord.ext import commands
+from json import dumps, loads
+from plugins.outbound import Priority
+from time import monotonic
+from uuid import uuid4
+from weakref import WeakKeyDictionary
 
 
-class Attachment:
+class Extra:
+    """The base of anything that users add to a report (i.e. stances, notes and attachments).
+    
+    Authors are kept as IDs and only looked up in the user cache the first time they're accessed."""
+
+    __slots__ = ("_author", "_resolver")
+
+    def __init__(self,
+                 author: discord.User,
+                 resolver: callable = None):
+        self._author = author
+        self._resolver = resolver
+
+    @property
+    def author(self) -> discord.User:
+        if self._resolver is not None:
+            author = self._resolver(self._author)
+
+            # Authors that couldn't be found are looked up again next time, they may have been resolved since.
+            if isinstance(author, int):
+                return author
+
+            self._author = author
+            self._resolver = None
+
+        return self._author
+
+    @property
+    def author_id(self) -> int:
+        if isinstance(self._author, int):
+            return self._author
+
+        return self._author.id
+
+class Attachment(Extra):
+    __slots__ = ("url", "name")
+
     def __init__(self,
                  author: discord.User,
                  url: str,
-                 name: str):
-        self.author: discord.User = author
+                 name: str,
+                 resolver: callable = None):
+        super().__init__(author, resolver)
+
         self.url: str = url
         self.name: str = name
 
-        self.content: str = f"[{self.name}]({self.url})"
+    @property
+    def content(self) -> str:
+        return f"[{self.name}]({self.url})"
 
     def __repr__(self) -> str:
-        return f"({self.author.id if isinstance(self.author, (discord.User, discord.Member)) else self.author}, '{self.url}', '{self.name}')"
+        return f"({self.author_id}, '{self.url}', '{self.name}')"
+
+class Note(Extra):
+    __slots__ = ("content",)
 
-class Note:
     def __init__(self,
                  author: discord.User,
-                 content: str):
-        self.author: discord.User = author
+                 content: str,
+                 resolver: callable = None):
+        super().__init__(author, resolver)
+
         self.content: str = content
     
     def __repr__(self) -> str:
-        return f"({self.author.id if isinstance(self.author, (discord.User, discord.Member)) else self.author}, '{self.content}')"
+        return f"({self.author_id}, '{self.content}')"
+
+class Stance(Extra):
+    __slots__ = ("type", "content")
 
-class Stance:
     def __init__(self,
                  type: int,
                  author: discord.User,
-                 content: str):
+                 content: str,
+                 resolver: callable = None):
+        super().__init__(author, resolver)
+
         self.type: int = type
-        self.author: discord.User = author
         self.content: str = content
 
     def __repr__(self) -> str:
-        if isinstance(self.author, (discord.User, discord.Member)):
-            id = self.author.id
-
-        else:
-            id = self.author
-
-        return f"({id}, '{self.content}')"
+        return f"({self.author_id}, '{self.content}')"
 
 class Issue:
+    __slots__ = ("id", "url", "state", "labels")
+
     def __init__(self,
                  id: int,
-                 url: str):
+                 url: str,
+                 state: str = None,
+                 labels: list = None):
         self.url: str = url
         self.id: int = id
+        self.state: str = state
+        self.labels: list = labels or []
+
+class ReportCache:
+    """An in-process LRU cache of report rows, keyed by report ID.
+    
+    The row is cached rather than the report, so every command gets its own Report to change and two commands can't trip over each other.
+    Entries are also dropped once they're older than the TTL, every write path is expected to call invalidate."""
+
+    def __init__(self,
+                 size: int = 256,
+                 ttl: float = 60):
+        self.size: int = size
+        self.ttl: float = ttl
+
+        self.entries: OrderedDict = OrderedDict()
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+
+    def get(self,
+            id: int) -> dict:
+        """Returns the cached row of the report with the provided ID, or None if it isn't cached or has expired."""
+
+        entry = self.entries.get(id)
+        if entry is None or monotonic() - entry[0] > self.ttl:
+            if entry is not None:
+                del self.entries[id]
+
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(id)
+        self.hits += 1
+        return entry[1]
+
+    def put(self,
+            id: int,
+            data: dict):
+        """Adds a report's row to the cache, evicting the least recently used report if it's full."""
+
+        self.entries[id] = monotonic(), data
+        self.entries.move_to_end(id)
+
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self,
+                   id: int):
+        """Drops a report from the cache, this must be called whenever a report is written to."""
+
+        self.entries.pop(id, None)
+
+    def clear(self):
+        """Drops every report from the cache."""
+
+        self.entries.clear()
+
+    def stats(self) -> dict:
+        """Returns the hit/miss counters, these are shown by the stats command."""
+
+        lookups = self.hits + self.misses
+
+        return {
+            "size": f"{len(self.entries)}/{self.size}",
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit rate": f"{self.hits / lookups:.1%}" if lookups else "n/a",
+            "evictions": self.evictions
+        }
+
+class Profile:
+    """A snapshot of a user that isn't in Discord.py's cache, it has just enough of discord.User to be rendered."""
+
+    __slots__ = ("id", "name", "discriminator", "avatar_url")
+
+    def __init__(self,
+                 id: int,
+                 name: str,
+                 discriminator: str,
+                 avatar_url: str):
+        self.id: int = id
+        self.name: str = name
+        self.discriminator: str = discriminator
+        self.avatar_url: str = avatar_url
+
+    @classmethod
+    def from_user(cls,
+                  user: discord.User):
+        return cls(user.id, user.name, user.discriminator, str(user.avatar_url))
+
+    @property
+    def mention(self) -> str:
+        return f"<@{self.id}>"
+
+    def __str__(self) -> str:
+        return f"{self.name}#{self.discriminator}"
+
+class ProfileCache:
+    """Resolves users that aren't in Discord.py's cache without a fetch per user.
+
+    Missing users are first looked up in the user_profiles snapshots, whatever's left is fetched concurrently (under a cap) and snapshotted for next time.
+    Users that couldn't be fetched at all are remembered as missing until the TTL runs out."""
+
+    def __init__(self,
+                 bot: commands.Bot,
+                 size: int = 1024,
+                 ttl: float = 3600,
+                 snapshot_ttl: float = 604800,
+                 concurrency: int = 5):
+        self.bot = bot
+        self.size: int = size
+        self.ttl: float = ttl
+        self.snapshot_ttl: timedelta = timedelta(seconds=snapshot_ttl)
+        self.semaphore: Semaphore = Semaphore(concurrency)
+
+        self.entries: OrderedDict = OrderedDict()
+        self.hits: int = 0
+        self.snapshots: int = 0
+        self.fetches: int = 0
+        self.failures: int = 0
+
+    def lookup(self,
+               id: int):
+        """Returns (found, user), a user that's known to be missing is found but None."""
+
+        user = self.bot.get_user(id)
+        if user is not None:
+            return True, user
+
+        entry = self.entries.get(id)
+        if entry is None or monotonic() - entry[0] > self.ttl:
+            return False, None
+
+        self.entries.move_to_end(id)
+        self.hits += 1
+        return True, entry[1]
+
+    def get(self,
+            id: int):
+        """Returns the cached user or profile, or None if it hasn't been resolved."""
+
+        return self.lookup(id)[1]
+
+    def put(self,
+            id: int,
+            profile: Profile):
+        self.entries[id] = monotonic(), profile
+        self.entries.move_to_end(id)
+
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    async def fetch(self,
+                    id: int) -> Profile:
+        async with self.semaphore:
+            try:
+                self.fetches += 1
+                return Profile.from_user(await self.bot.fetch_user(id))
+
+            except discord.HTTPException:
+                self.failures += 1
+                return None
+
+    async def resolve(self,
+                      ids):
+        """Makes sure every user in ids can be rendered, this costs at most one query, one batch of fetches and one write."""
+
+        missing = {id for id in ids if isinstance(id, int) and not self.lookup(id)[0]}
+        if not missing:
+            return
+
+        async with self.bot.postgres.acquire() as con:
+            rows = await self.bot.queries.fetch(con, "profile.get",
+                                                list(missing), datetime.utcnow() - self.snapshot_ttl)
+
+        for row in rows:
+            self.snapshots += 1
+            self.put(row["id"], Profile(row["id"], row["name"], row["discriminator"], row["avatar_url"]))
+            missing.discard(row["id"])
+
+        if not missing:
+            return
+
+        missing = list(missing)
+        profiles = await gather(*(self.fetch(id) for id in missing))
+
+        for id, profile in zip(missing, profiles):
+            self.put(id, profile)
+
+        fetched = [p for p in profiles if p is not None]
+        if fetched:
+            async with self.bot.postgres.acquire() as con:
+                await self.bot.queries.execute(con, "profile.save",
+                                               [p.id for p in fetched], [p.name for p in fetched], [p.discriminator for p in fetched], [p.avatar_url for p in fetched], datetime.utcnow())
+
+    def stats(self) -> dict:
+        """Returns the profile counters, these are shown by the stats command."""
+
+        return {
+            "size": f"{len(self.entries)}/{self.size}",
+            "hits": self.hits,
+            "snapshots": self.snapshots,
+            "fetches": self.fetches,
+            "failures": self.failures
+        }
+
+class ApprovalCache:
+    """An LRU cache of approval queue messages, keyed by message ID.
+    
+    Messages that aren't cached are edited through a partial message, so editing never needs a fetch first.
+    A message is only fetched when its full contents are needed, and is dropped once Discord says it's gone."""
+
+    def __init__(self,
+                 bot: commands.Bot,
+                 size: int = 256):
+        self.bot = bot
+        self.size: int = size
+
+        self.entries: OrderedDict = OrderedDict()
+        self.hits: int = 0
+        self.partials: int = 0
+        self.fetches: int = 0
+        self.missing: int = 0
+
+    @property
+    def queue(self) -> discord.TextChannel:
+        return self.bot.get_channel(self.bot.config["channels"]["approval"])
+
+    def put(self,
+            message: discord.Message):
+        """Adds a message to the cache, evicting the least recently used message if it's full."""
+
+        self.entries[message.id] = message
+        self.entries.move_to_end(message.id)
+
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def evict(self,
+              id: int):
+        """Drops a message from the cache, i.e. when it has been deleted."""
+
+        self.entries.pop(id, None)
+
+    def get(self,
+            id: int):
+        """Returns the cached message, or a partial message that can be edited or deleted without a fetch."""
+
+        if id is None:
+            return None
+
+        message = self.entries.get(id)
+        if message is not None:
+            self.entries.move_to_end(id)
+            self.hits += 1
+            return message
+
+        queue = self.queue
+        if queue is None:
+            return None
+
+        self.partials += 1
+        message = queue.get_partial_message(id)
+        self.put(message)
+        return message
+
+    async def fetch(self,
+                    id: int) -> discord.Message:
+        """Returns the full message, only fetching it if a full copy isn't cached."""
+
+        message = self.get(id)
+        if message is None or isinstance(message, discord.Message):
+            return message
+
+        try:
+            self.fetches += 1
+            message = await message.fetch()
+
+        except discord.NotFound:
+            self.missing += 1
+            self.evict(id)
+            return None
+
+        except discord.HTTPException:
+            return None
+
+        self.put(message)
+        return message
+
+    async def edit(self,
+                   id: int,
+                   **fields) -> discord.Message:
+        """Edits a message, returns None if it no longer exists."""
+
+        message = self.get(id)
+        if message is None:
+            return None
+
+        try:
+            edited = await self.bot.outbound.edit(message, **fields)
+
+        except discord.NotFound:
+            self.missing += 1
+            self.evict(id)
+            return None
+
+        if isinstance(edited, discord.Message):
+            self.put(edited)
+
+        return edited or message
+
+    async def delete(self,
+                     id: int) -> bool:
+        """Deletes a message, returns False if it was already gone."""
+
+        message = self.get(id)
+        self.evict(id)
+
+        if message is None:
+            return False
+
+        try:
+            await self.bot.outbound.delete(message, priority=Priority.EDIT)
+
+        except discord.NotFound:
+            self.missing += 1
+            return False
+
+        return True
+
+    def stats(self) -> dict:
+        """Returns the cache counters, these are shown by the stats command."""
+
+        return {
+            "size": f"{len(self.entries)}/{self.size}",
+            "hits": self.hits,
+            "partials": self.partials,
+            "fetches": self.fetches,
+            "missing": self.missing
+        }
+
+# Maps the plain attributes of a report to the bug_reports columns they're loaded from.
+FIELDS = {
+    "id": "id",
+    "short": "short_description",
+    "expected": "expected_result",
+    "actual": "actual_result",
+    "software": "software_version",
+    "locked": "locked",
+    "created_at": "created_at",
+    "stance": "stance",
+    "version": "version"
+}
+
+# Every column on bug_reports that from_db can be asked for.
+COLUMNS = frozenset((
+    "id", "reporter_id", "board_id", "message_id", "short_description", "steps_to_reproduce", "expected_result",
+    "actual_result", "software_version", "issue_url", "issue_id", "stance", "locked", "created_at", "version",
+    "board_message_id", "issue_state", "issue_labels", "issue_updated_at"
+))
+
+# Stances, notes and attachments live in their own tables, these aggregate them into JSON alongside the report.
+EXTRAS = {
+    "stances": "COALESCE((SELECT json_agg(json_build_array(s.author_id, s.type, s.content) ORDER BY s.created_at) FROM report_stances s WHERE s.report_id = r.id), '[]') AS stances",
+    "notes": "COALESCE((SELECT json_agg(json_build_array(n.author_id, n.content) ORDER BY n.id) FROM report_notes n WHERE n.report_id = r.id), '[]') AS notes",
+    "attachments": "COALESCE((SELECT json_agg(json_build_array(a.author_id, a.url, a.name) ORDER BY a.id) FROM report_attachments a WHERE a.report_id = r.id), '[]') AS attachments"
+}
 
 class Report:
+    """A bug report, the heavy fields (steps, stances, notes and attachments) are only parsed when they're first accessed.
+    
+    Reports loaded with a subset of columns raise AttributeError when anything that wasn't selected is accessed."""
+
+    __slots__ = ("raw", "bot", "id", "short", "expected", "actual", "software", "locked", "created_at", "stance", "version",
+                 "_steps", "_approves", "_denies", "_attachments", "_notes", "_issue")
+
     def __init__(self,
                  bot: commands.Bot,
                  **data: dict):
@@ -65,53 +495,153 @@ class Report:
 
         self.bot: commands.Bot = bot
 
-        self.id: int = data.pop("id")
-        self.short: str = data.pop("short_description")
-        self.steps: list = literal_eval(data.pop("steps_to_reproduce"))
-        self.expected: str = data.pop("expected_result")
-        self.actual: str = data.pop("actual_result")
-        self.software: str = data.pop("software_version")
+        for attr, column in FIELDS.items():
+            if column in data:
+                setattr(self, attr, data.pop(column))
 
-        self.approves: list = [Stance(1, self.get_user(author_id), content) for author_id, content in literal_eval(data.pop("approves", "[]"))]
-        self.denies: list = [Stance(-1, self.get_user(author_id), content) for author_id, content in literal_eval(data.pop("denies", "[]"))]
-        self.stances: list = self.approves + self.denies
-        
-        self.attachments: list = [Attachment(self.get_user(author_id), url, name) for author_id, url, name in literal_eval(data.pop("attachments", "[]"))]
-        self.notes: list = [Note(self.get_user(author_id), content) for author_id, content in literal_eval(data.pop("notes", "[]"))]
+        self._steps: list = None
+        self._approves: list = None
+        self._denies: list = None
+        self._attachments: list = None
+        self._notes: list = None
+        self._issue: Issue = None
+
+    def refresh(self,
+                report):
+        """Copies the state of a freshly loaded report into this one, for commands that are still holding onto it."""
+
+        for attr in Report.__slots__:
+            if hasattr(report, attr):
+                setattr(self, attr, getattr(report, attr))
+
+    def load(self,
+             column: str):
+        """Takes a column that's parsed lazily out of the raw data."""
+
+        try:
+            return self.raw.pop(column)
+
+        except KeyError:
+            raise AttributeError(f"{column} wasn't selected for report #{self.id}") from None
+
+    @property
+    def steps(self) -> list:
+        if self._steps is None:
+            self._steps = literal_eval(self.load("steps_to_reproduce"))
+
+        return self._steps
 
-        self.locked: bool = data.pop("locked")
-        self.created_at: datetime = data.pop("created_at")
-        self.stance: int = data.pop("stance")
+    @steps.setter
+    def steps(self,
+              value: list):
+        self._steps = value
 
-        self.issue: Issue = Issue(id=data.pop("issue_id"),
-                                  url=data.pop("issue_url"))
+    @property
+    def approves(self) -> list:
+        if self._approves is None:
+            self.load_stances()
+
+        return self._approves
+
+    @property
+    def denies(self) -> list:
+        if self._denies is None:
+            self.load_stances()
+
+        return self._denies
+
+    @property
+    def stances(self) -> list:
+        return self.approves + self.denies
+
+    def load_stances(self):
+        """Splits the aggregated stances into approvals and denials."""
+
+        self._approves, self._denies = [], []
+
+        for author_id, type, content in loads(self.load("stances")):
+            stance = Stance(type, author_id, content, self.get_user)
+            (self._approves if type == 1 else self._denies).append(stance)
+
+    @property
+    def attachments(self) -> list:
+        if self._attachments is None:
+            self._attachments = [Attachment(author_id, url, name, self.get_user) for author_id, url, name in loads(self.load("attachments"))]
+
+        return self._attachments
+
+    @property
+    def notes(self) -> list:
+        if self._notes is None:
+            self._notes = [Note(author_id, content, self.get_user) for author_id, content in loads(self.load("notes"))]
+
+        return self._notes
+
+    @property
+    def issue(self) -> Issue:
+        if self._issue is None:
+            labels = self.raw.get("issue_labels")
+            self._issue = Issue(id=self.raw.get("issue_id"),
+                                url=self.raw.get("issue_url"),
+                                state=self.raw.get("issue_state"),
+                                labels=loads(labels) if labels is not None else None)
+
+        return self._issue
+
+    def place_stance(self,
+                     stance: Stance):
+        """Replaces the author's existing stance (if any) with the provided one, this doesn't touch the database."""
+
+        self.remove_stance(stance.author_id)
+        (self.approves if stance.type == 1 else self.denies).append(stance)
+
+    def remove_stance(self,
+                      id: int) -> Stance:
+        """Removes a user's stance from the report, this doesn't touch the database."""
+
+        stance = self.get_stance(id)
+
+        if stance is not None:
+            (self.approves if stance.type == 1 else self.denies).remove(stance)
+
+        return stance
 
     def get_stance(self,
                    id: int) -> Stance:
         """Returns an existing stance on the report."""
     
         for stance in self.stances:
-            if isinstance(stance.author, (discord.User, discord.Member)):
-                if stance.author.id == id:
-                    return stance
-
-            else:
-                if stance.author == id:
-                    return stance
+            if stance.author_id == id:
+                return stance
 
         return None
 
     def get_user(self,
                  id: int) -> discord.User:
-        """Searches cache for a user's ID and returns the ID if it isn't present in cache."""
+        """Searches cache (and resolved profiles) for a user's ID and returns the ID if it isn't present in either."""
 
-        cache = self.bot.get_user(id)
+        cache = self.bot.profiles.get(id)
 
         if cache is not None:
             return cache
 
         return id
 
+    async def resolve_users(self):
+        """Resolves the reporter and every author of the report in a single batch, call this before rendering."""
+
+        ids = {self.raw.get("reporter_id")}
+
+        for extras in ("stances", "notes", "attachments"):
+            try:
+                ids.update(e.author_id for e in getattr(self, extras))
+
+            except AttributeError:
+                # Partial reports don't always select every extra.
+                continue
+
+        await self.bot.profiles.resolve(ids)
+
     def update(self,
                key: str,
                value: str):
@@ -137,54 +667,1085 @@ class Report:
 
     @property
     async def approval_message(self) -> discord.Message:
-        try:
-            queue = self.bot.get_channel(self.bot.config["channels"]["approval"])
-            if queue is None:
-                return None
+        return await self.bot.approvals.fetch(self.raw.get("message_id"))
 
-            return await queue.fetch_message(self.raw.get("message_id"))
+    async def edit_approval(self,
+                            **fields) -> discord.Message:
+        """Edits the approval queue message without fetching it first, returns None if it no longer exists."""
 
-        except discord.HTTPException:
-            return None
+        return await self.bot.approvals.edit(self.raw.get("message_id"), **fields)
+
+    async def delete_approval(self) -> bool:
+        """Deletes the approval queue message, returns False if it was already gone."""
+
+        return await self.bot.approvals.delete(self.raw.get("message_id"))
 
     @classmethod
     async def from_db(cls,
                       bot: commands.Bot,
-                      id: int):
-        """Returns a class with data from the database given the provided ID."""
+                      id: int,
+                      *columns: str,
+                      cached: bool = True):
+        """Returns a class with data from the database given the provided ID.
+        
+        Commands that don't need the whole report can pass the columns (or extras) they need, these reports aren't cached.
+        Full reports are served from the bot's report cache when possible, unless cached is False.
+        Every call returns a new Report, so the caller is free to change it."""
 
-        async with bot.postgres.acquire() as con:
-            query = """SELECT *
-                       FROM bug_reports
-                       WHERE id = $1;"""
+        if cached:
+            data = bot.reports.get(id)
+            if data is not None:
+                return cls(bot, **data)
+
+        name = "report.get"
+        if columns:
+            unknown = set(columns) - COLUMNS - EXTRAS.keys()
+            if unknown:
+                raise ValueError(f"Unknown report columns: {', '.join(unknown)}")
+
+            columns = sorted({"id", *columns})
+            name = f"report.get.{'.'.join(columns)}"
 
-            data = await con.fetchrow(query,
-                                      id)
+            if name not in bot.queries.queries:
+                bot.queries.register(name, f"""SELECT {', '.join(EXTRAS.get(c, f"r.{c}") for c in columns)}
+                                               FROM bug_reports r
+                                               WHERE r.id = $1;""")
+
+        async with bot.postgres.acquire() as con:
+            data = await bot.queries.fetchrow(con, name,
+                                              id)
 
             if data is None:
                 return None
 
             data = dict(data)
-            for key in ("approves", "denies", "attachments", "notes"):
-                if not data.get(key):
-                    data[key] = "[]"
+            if not columns:
+                bot.reports.put(id, data)
 
             return cls(bot, **data)
 
+# Every statement that commands run, keyed by name.
+# These are prepared on every pooled connection ahead of time, so don't build SQL on the fly in plugins, add it here instead.
+QUERIES = {
+    "report.get": f"""SELECT {', '.join(f"r.{c}" for c in sorted(COLUMNS))}, {', '.join(EXTRAS.values())}
+                      FROM bug_reports r
+                      WHERE r.id = $1;""",
+    "report.insert": """INSERT INTO bug_reports (reporter_id, board_id, short_description, steps_to_reproduce, expected_result, actual_result, software_version, stance, created_at)
+                        VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9)
+                        RETURNING id;""",
+    "report.messages": """UPDATE bug_reports r
+                          SET message_id = m.message_id,
+                          version = r.version + 1
+                          FROM unnest($1::INT[], $2::BIGINT[]) AS m (id, message_id)
+                          WHERE r.id = m.id;""",
+    "report.unposted": """SELECT id
+                          FROM bug_reports
+                          WHERE message_id IS NULL
+                          AND stance = 0
+                          AND created_at < $1
+                          ORDER BY id
+                          LIMIT 50;""",
+    "report.board_message": """UPDATE bug_reports
+                               SET board_message_id = $1,
+                               version = version + 1
+                               WHERE id = $2
+                               RETURNING issue_url;""",
+    "report.issue": """UPDATE bug_reports
+                       SET issue_url = $1,
+                       issue_id = $2,
+                       version = version + 1
+                       WHERE id = $3;""",
+
+    # Everything below is a compare-and-swap against the report's version, see compare_and_swap.
+    "report.lock": """UPDATE bug_reports
+                      SET locked = $1,
+                      version = version + 1
+                      WHERE id = $2
+                      AND version = $3
+                      AND stance = 0
+                      AND COALESCE(locked, FALSE) <> $1
+                      RETURNING version;""",
+    "stance.cast": """SELECT *
+                      FROM cast_stance($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11);""",
+    "stance.revoke": """WITH report AS (
+                            UPDATE bug_reports
+                            SET version = version + 1
+                            WHERE id = $1
+                            AND version = $3
+                            AND stance = 0
+                            AND NOT COALESCE(locked, FALSE)
+                            AND EXISTS (SELECT 1 FROM report_stances WHERE report_id = $1 AND author_id = $2)
+                            RETURNING id
+                        )
+                        DELETE FROM report_stances s
+                        USING report r
+                        WHERE s.report_id = r.id
+                        AND s.author_id = $2
+                        RETURNING s.type;""",
+    "note.add": """WITH report AS (
+                       UPDATE bug_reports
+                       SET version = version + 1
+                       WHERE id = $1
+                       AND version = $5
+                       AND stance = 0
+                       AND NOT COALESCE(locked, FALSE)
+                       AND (SELECT COUNT(*) FROM report_notes WHERE report_id = $1) < $6
+                       RETURNING id
+                   )
+                   INSERT INTO report_notes (report_id, author_id, content, created_at)
+                   SELECT id, $2::BIGINT, $3::TEXT, $4::TIMESTAMP
+                   FROM report
+                   RETURNING id;""",
+    "attachment.add": """WITH report AS (
+                             UPDATE bug_reports
+                             SET version = version + 1
+                             WHERE id = $1
+                             AND version = $6
+                             AND stance = 0
+                             AND NOT COALESCE(locked, FALSE)
+                             RETURNING id
+                         )
+                         INSERT INTO report_attachments (report_id, author_id, url, name, created_at)
+                         SELECT id, $2::BIGINT, $3::TEXT, $4::TEXT, $5::TIMESTAMP
+                         FROM report
+                         RETURNING id;""",
+    "change.publish": """SELECT pg_notify($1, $2);""",
+    "ephemeral.add": """INSERT INTO ephemeral_messages (message_id, channel_id, expires_at)
+                        SELECT * FROM unnest($1::BIGINT[], $2::BIGINT[], $3::TIMESTAMP[])
+                        ON CONFLICT (message_id) DO NOTHING;""",
+    "ephemeral.remove": """DELETE FROM ephemeral_messages
+                           WHERE message_id = ANY($1::BIGINT[]);""",
+    "ephemeral.pending": """SELECT message_id, channel_id, expires_at
+                            FROM ephemeral_messages;""",
+    "ephemeral.prune": """DELETE FROM ephemeral_messages
+                          WHERE expires_at < $1;""",
+    "profile.get": """SELECT id, name, discriminator, avatar_url
+                      FROM user_profiles
+                      WHERE id = ANY($1::BIGINT[])
+                      AND updated_at > $2;""",
+    "profile.save": """INSERT INTO user_profiles (id, name, discriminator, avatar_url, updated_at)
+                       SELECT p.*, $5::TIMESTAMP
+                       FROM unnest($1::BIGINT[], $2::TEXT[], $3::TEXT[], $4::TEXT[]) AS p
+                       ON CONFLICT (id) DO UPDATE
+                       SET name = excluded.name,
+                       discriminator = excluded.discriminator,
+                       avatar_url = excluded.avatar_url,
+                       updated_at = excluded.updated_at;""",
+    "issue.sync": """UPDATE bug_reports r
+                     SET issue_state = u.state,
+                     issue_labels = u.labels::JSON,
+                     issue_updated_at = u.updated_at,
+                     version = r.version + 1
+                     FROM unnest($1::BIGINT[], $2::INT[], $3::TEXT[], $4::TEXT[], $5::TIMESTAMP[]) AS u (board_id, issue_id, state, labels, updated_at)
+                     WHERE r.board_id = u.board_id
+                     AND r.issue_id = u.issue_id
+                     AND (r.issue_updated_at IS NULL OR r.issue_updated_at < u.updated_at)
+                     RETURNING r.id;""",
+    "sync.get": """SELECT repo, etag, since
+                   FROM github_sync;""",
+    "sync.save": """INSERT INTO github_sync (repo, etag, since, synced_at)
+                    VALUES ($1, $2, $3, $4)
+                    ON CONFLICT (repo) DO UPDATE
+                    SET etag = excluded.etag,
+                    since = excluded.since,
+                    synced_at = excluded.synced_at;""",
+    "outbox.finish": """DELETE FROM github_outbox
+                        WHERE report_id = $1
+                        AND kind = $2;""",
+    "outbox.claim": """UPDATE github_outbox o
+                       SET attempts = o.attempts + 1,
+                       run_after = $2
+                       WHERE o.id IN (SELECT id
+                                      FROM github_outbox
+                                      WHERE run_after <= $1
+                                      ORDER BY id
+                                      LIMIT $3
+                                      FOR UPDATE SKIP LOCKED)
+                       RETURNING o.id, o.report_id, o.kind, o.repo, o.attempts, o.created_at;""",
+    "outbox.remaining": """SELECT COUNT(*)
+                           FROM github_outbox
+                           WHERE kind = $1
+                           AND repo = $2
+                           AND run_after < 'infinity';""",
+    "outbox.done": """DELETE FROM github_outbox
+                      WHERE id = $1;""",
+    "outbox.retry": """UPDATE github_outbox
+                       SET run_after = $2,
+                       error = $3
+                       WHERE id = $1;""",
+    "outbox.abandon": """UPDATE github_outbox
+                         SET run_after = 'infinity',
+                         error = $2
+                         WHERE id = $1;"""
+}
+
+# Each editable section gets its own statement, since column names can't be parameters.
+for column in ("short_description", "steps_to_reproduce", "expected_result", "actual_result", "software_version"):
+    QUERIES[f"report.edit.{column}"] = f"""UPDATE bug_reports
+                                           SET {column} = $1,
+                                           version = version + 1
+                                           WHERE id = $2
+                                           AND version = $3
+                                           AND stance = 0
+                                           AND NOT COALESCE(locked, FALSE)
+                                           RETURNING version;"""
+
+class QueryRegistry:
+    """Holds a prepared statement for every query in QUERIES on every pooled connection.
+    
+    Statements are prepared once Postgres has connected (the tables need to exist first) and on every connection opened after that."""
+
+    def __init__(self,
+                 queries: dict):
+        self.queries: dict = queries
+        self.statements: WeakKeyDictionary = WeakKeyDictionary()
+        self.ready: bool = False
+
+        self.prepared: int = 0
+        self.lazy: int = 0
+        self.invalidated: int = 0
+
+    def register(self,
+                 name: str,
+                 query: str):
+        """Adds a query to the registry, it's prepared on each connection the first time it's used there."""
+
+        self.queries[name] = query
+
+    async def prepare(self,
+                      con):
+        """Prepares any statements that the connection doesn't already have."""
+
+        # Pooled connections are proxies, statements belong to the connection underneath.
+        raw = getattr(con, "_con", con)
+        statements = self.statements.setdefault(raw, {})
+
+        for name, query in self.queries.items():
+            if name not in statements:
+                statements[name] = await raw.prepare(query)
+                self.prepared += 1
+
+    async def init_connection(self,
+                              con):
+        """Used as a connection init hook, this does nothing until the schema is ready."""
+
+        if self.ready:
+            await self.prepare(con)
+
+    async def statement(self,
+                        con,
+                        name: str):
+        """Returns the prepared statement with the provided name for this connection."""
+
+        raw = getattr(con, "_con", con)
+        statement = self.statements.get(raw, {}).get(name)
+
+        if statement is None:
+            self.lazy += 1
+            statement = await raw.prepare(self.queries[name])
+            self.statements.setdefault(raw, {})[name] = statement
+
+        return statement
+
+    async def run(self,
+                  con,
+                  name: str,
+                  method: str,
+                  *args):
+        """Runs a prepared statement, it's prepared again and retried once if a schema change made it invalid (i.e. another worker migrated)."""
+
+        try:
+            return await getattr(await self.statement(con, name), method)(*args)
+
+        except InvalidCachedStatementError:
+            raw = getattr(con, "_con", con)
+            self.statements.get(raw, {}).pop(name, None)
+            self.invalidated += 1
+
+            # The failed statement aborted the transaction it ran in, the next use outside of one prepares it again.
+            if raw.is_in_transaction():
+                raise
+
+            return await getattr(await self.statement(con, name), method)(*args)
+
+    async def fetch(self,
+                    con,
+                    name: str,
+                    *args) -> list:
+        return await self.run(con, name, "fetch", *args)
+
+    async def fetchrow(self,
+                       con,
+                       name: str,
+                       *args):
+        return await self.run(con, name, "fetchrow", *args)
+
+    async def fetchval(self,
+                       con,
+                       name: str,
+                       *args):
+        return await self.run(con, name, "fetchval", *args)
+
+    async def execute(self,
+                      con,
+                      name: str,
+                      *args):
+        """Runs a statement and discards any rows it returns."""
+
+        await self.run(con, name, "fetch", *args)
+
+    def stats(self) -> dict:
+        """Returns how many statements have been prepared, these are shown by the stats command."""
+
+        return {
+            "queries": len(self.queries),
+            "connections": len(self.statements),
+            "prepared at warm-up": self.prepared,
+            "prepared on demand": self.lazy,
+            "re-prepared": self.invalidated
+        }
+
+# Every process publishes report writes on this channel and listens to it so that their caches stay coherent.
+NOTIFY_CHANNEL = "bug_report_changes"
+
+# This identifies the current process in change notifications.
+ORIGIN = uuid4().hex
+
+async def publish_change(bot: commands.Bot,
+                         con,
+                         id: int,
+                         *fields: str):
+    """Tells every bot process (including this one) that a report has been written to.
+    
+    This must be called with the connection that made the write, the notification is only delivered once it's committed."""
+
+    bot.reports.invalidate(id)
+
+    await bot.queries.execute(con, "change.publish",
+                              NOTIFY_CHANNEL, dumps({"id": id, "fields": fields, "origin": ORIGIN}))
+
+class ReportConflict(commands.CommandError):
+    """Raised when a report can't be written to, either because it's changed in a way that makes the write invalid or because it kept changing."""
+
+class Contention:
+    """Counts how often compare-and-swap writes lose the race, these are shown by the stats command."""
+
+    def __init__(self,
+                 retries: int = 3):
+        self.retries: int = retries
+
+        self.writes: int = 0
+        self.conflicts: int = 0
+        self.rejected: int = 0
+        self.exhausted: int = 0
+
+    def stats(self) -> dict:
+        """Returns the conflict and retry counters."""
+
+        return {
+            "writes": self.writes,
+            "conflicts": self.conflicts,
+            "conflict rate": f"{self.conflicts / self.writes:.1%}" if self.writes else "n/a",
+            "rejected after reload": self.rejected,
+            "out of retries": self.exhausted
+        }
+
+def is_open(report: Report) -> str:
+    """The default guard for compare_and_swap, this returns why a report can't be changed (if it can't)."""
+
+    if report.locked:
+        return "This report has been locked by admins."
+
+    if report.stance != 0:
+        return "This report has already been moved."
+
+    return None
+
+async def compare_and_swap(bot: commands.Bot,
+                           report: Report,
+                           fields: tuple,
+                           write: callable,
+                           guard: callable = is_open,
+                           publish: bool = True):
+    """Runs a write against the version of the report that was read, retrying a bounded number of times if it's been changed since.
+    
+    write is called with a connection and the expected version, and returns None if the report wasn't at that version (i.e. no rows).
+    After a conflict the report is reloaded in place and guard is asked whether the write still makes sense, if it returns a reason
+    then ReportConflict is raised with it. The report's version is bumped and the change is published once the write succeeds,
+    pass publish=False if the write publishes the change itself."""
+
+    for _ in range(bot.contention.retries + 1):
+        bot.contention.writes += 1
+
+        async with bot.postgres.acquire() as con:
+            result = await write(con, report.version)
+
+            if result is not None:
+                if publish:
+                    await publish_change(bot, con, report.id, *fields)
+
+                else:
+                    bot.reports.invalidate(report.id)
+
+        if result is not None:
+            report.version += 1
+            return result
+
+        bot.contention.conflicts += 1
+
+        fresh = await Report.from_db(bot, report.id, cached=False)
+        if fresh is None:
+            raise ReportConflict("No report was found with your query.")
+
+        report.refresh(fresh)
+
+        reason = guard(report)
+        if reason is not None:
+            bot.contention.rejected += 1
+            raise ReportConflict(reason)
+
+    bot.contention.exhausted += 1
+    raise ReportConflict("This report is being changed by a lot of people right now, please try again.")
+
+async def cast_stance(bot: commands.Bot,
+                      report: Report,
+                      stance: Stance,
+                      force: bool = False):
+    """Places a stance and moves the report if it crosses the threshold, all in one round-trip (see the cast_stance function).
+    
+    Whatever has to happen once a report is approved is queued by the same statement, so it can't be lost if the process dies.
+    This returns a record of the new tallies: approve_count, deny_count, previous (the type of the author's old stance, if any),
+    outcome (the new stance of the report) and crossed."""
+
+    outbox = getattr(bot, "outbox", None)
+    board_after, repo = outbox.approval_jobs(report) if outbox is not None else (None, None)
+
+    async def write(con, version: int):
+        return await bot.queries.fetchrow(con, "stance.cast",
+                                          report.id, stance.author_id, stance.type, stance.content, bot.config["stances_needed"], force, version,
+                                          NOTIFY_CHANNEL, ORIGIN, board_after, repo)
+
+    result = await compare_and_swap(bot, report, ("stances", "stance"), write, publish=False)
+
+    if outbox is not None and result["crossed"]:
+        outbox.notify()
+
+    report.place_stance(stance)
+    report.stance = result["outcome"]
+    return result
+
+async def revoke_stance(bot: commands.Bot,
+                        report: Report,
+                        id: int) -> int:
+    """Removes a user's stance from a report that's still in the queue, returning the type of the removed stance."""
+
+    def guard(report: Report) -> str:
+        if report.get_stance(id) is None:
+            return "You haven't placed a stance on this report yet."
+
+        return is_open(report)
+
+    async def write(con, version: int):
+        return await bot.queries.fetchval(con, "stance.revoke",
+                                          report.id, id, version)
+
+    type = await compare_and_swap(bot, report, ("stances",), write, guard)
+
+    report.remove_stance(id)
+    return type
+
+def connection_options(config: dict) -> dict:
+    """Returns the keyword arguments used to connect to Postgres."""
+
+    return {
+        "host": config.get("host", "127.0.0.1"),
+        "port": config.get("port", "5432"),
+        "user": config.get("user", "postgres"),
+        "password": config.get("password"),
+        "database": config.get("database", "postgres"),
+        "server_settings": {"application_name": config.get("application_name", "bugbot")}
+    }
+
+class ConnectionManager:
+    """Owns the asyncpg pool that every plugin acquires connections from.
+    
+    The pool is health checked in the background and rebuilt if Postgres goes away, acquire waits are measured so the pool can be sized."""
+
+    def __init__(self,
+                 bot: commands.Bot,
+                 config: dict):
+        self.bot: commands.Bot = bot
+        self.options: dict = connection_options(config)
+
+        # Pool sizes are for the whole cluster, each worker gets an even share of them.
+        index, workers = getattr(bot, "worker", (0, 1))
+        if workers > 1:
+            self.options["server_settings"]["application_name"] += f"-{index}"
+
+        self.min_size: int = max(1, config.get("min_size", 2) // workers)
+        self.max_size: int = max(self.min_size, config.get("max_size", 10) // workers)
+        self.max_inactive: float = config.get("max_inactive_connection_lifetime", 300)
+        self.acquire_timeout: float = config.get("acquire_timeout", 10)
+        self.health_interval: float = config.get("health_check_interval", 30)
+
+        # Coroutine functions called with every new connection, before it's handed out by the pool.
+        self.init_hooks: list = []
+
+        self.pool = None
+        self.healthy: bool = False
+        self.task = None
+
+        self.waiting: int = 0
+        self.peak_waiting: int = 0
+        self.acquires: int = 0
+        self.wait_total: float = 0
+        self.wait_max: float = 0
+        self.timeouts: int = 0
+        self.failed_checks: int = 0
+        self.reconnects: int = 0
+
+    async def init_connection(self,
+                              con):
+        """Runs the init hooks against a freshly opened connection."""
+
+        for hook in self.init_hooks:
+            await hook(con)
+
+    async def connect(self):
+        """Creates the pool and starts the background health checks."""
+
+        self.pool = await create_pool(**self.options,
+                                      min_size=self.min_size,
+                                      max_size=self.max_size,
+                                      max_inactive_connection_lifetime=self.max_inactive,
+                                      init=self.init_connection)
+        self.healthy = True
+
+        if self.task is None:
+            self.task = self.bot.loop.create_task(self.health_check())
+
+    async def close(self):
+        """Stops the health checks and gracefully closes every connection in the pool."""
+
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+        if self.pool is not None:
+            await self.pool.close()
+
+    @asynccontextmanager
+    async def acquire(self):
+        """Acquires a connection from the pool, this is a drop-in replacement for Pool.acquire."""
+
+        self.waiting += 1
+        self.peak_waiting = max(self.peak_waiting, self.waiting)
+        start = monotonic()
+
+        try:
+            con = await self.pool.acquire(timeout=self.acquire_timeout)
+
+        except TimeoutError:
+            self.timeouts += 1
+            raise
+
+        finally:
+            self.waiting -= 1
+
+        waited = monotonic() - start
+        self.acquires += 1
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+
+        try:
+            yield con
+
+        finally:
+            await self.pool.release(con)
+
+    async def ping(self) -> bool:
+        """Returns whether or not Postgres can run a query.
+
+        This opens a connection of its own, a pool that's only saturated doesn't mean Postgres has gone away."""
+
+        try:
+            con = await connect(**self.options,
+                                timeout=self.acquire_timeout)
+
+        except (OSError, PostgresError, TimeoutError):
+            return False
+
+        try:
+            await wait_for(con.fetchval("SELECT 1;"), timeout=self.acquire_timeout)
+
+        except (OSError, PostgresError, TimeoutError):
+            con.terminate()
+            return False
+
+        await con.close()
+        return True
+
+    async def reconnect(self):
+        """Throws away every pooled connection and waits until Postgres answers again, backing off between attempts."""
+
+        delay = 1
+
+        while True:
+            self.bot.log.warn(f"Postgres is unavailable, reconnecting in {delay} seconds.")
+            await sleep(delay)
+
+            await self.pool.expire_connections()
+            if await self.ping():
+                break
+
+            delay = min(delay * 2, 60)
+
+        self.reconnects += 1
+        self.healthy = True
+        self.bot.log.info("Successfully reconnected to Postgres server.")
+        self.bot.dispatch("postgres_connect")
+
+    async def health_check(self):
+        """Periodically pings Postgres, reconnecting the pool when the ping fails (i.e. Postgres has restarted)."""
+
+        try:
+            while True:
+                await sleep(self.health_interval)
+
+                if await self.ping():
+                    continue
+
+                self.failed_checks += 1
+                self.healthy = False
+                await self.reconnect()
+
+        except CancelledError:
+            pass
+
+    def stats(self) -> dict:
+        """Returns the pool's saturation and acquire-wait statistics, these are shown by the stats command."""
+
+        size = self.pool.get_size() if self.pool is not None else 0
+        in_use = size - (self.pool.get_idle_size() if self.pool is not None else 0)
+
+        return {
+            "healthy": self.healthy,
+            "connections": f"{in_use} in use, {size - in_use} idle ({self.min_size}-{self.max_size})",
+            "saturation": f"{in_use / self.max_size:.0%}",
+            "waiting": f"{self.waiting} (peak {self.peak_waiting})",
+            "acquires": self.acquires,
+            "average wait": f"{self.wait_total / self.acquires * 1000:.1f}ms" if self.acquires else "n/a",
+            "max wait": f"{self.wait_max * 1000:.1f}ms",
+            "timeouts": self.timeouts,
+            "failed checks": self.failed_checks,
+            "reconnects": self.reconnects
+        }
+
+# These used to hold str()'d lists on bug_reports before they got their own tables.
+LEGACY_COLUMNS = "approves", "denies", "notes", "attachments"
+
+async def migrate_legacy_extras(bot: commands.Bot,
+                                con):
+    """Moves stances, notes and attachments out of the legacy TEXT columns on bug_reports and into their own tables.
+
+    Older versions stored these as the str() of a Python list, so this only does anything on databases created by them."""
+
+    query = """SELECT column_name
+               FROM information_schema.columns
+               WHERE table_name = 'bug_reports'
+               AND column_name = ANY($1::TEXT[]);"""
+
+    legacy = {r["column_name"] for r in await con.fetch(query, list(LEGACY_COLUMNS))}
+    if not legacy:
+        return
+
+    bot.log.info(f"Migrating legacy report columns: {', '.join(sorted(legacy))}")
+
+    rows = await con.fetch(f"SELECT id, created_at, {', '.join(sorted(legacy))} FROM bug_reports;")
+
+    stances, notes, attachments = [], [], []
+    for row in rows:
+        created_at = row["created_at"] or datetime.utcnow()
+
+        for type, key in ((1, "approves"), (-1, "denies")):
+            for index, (author_id, content) in enumerate(literal_eval(row.get(key) or "[]")):
+                stances.append((row["id"], author_id, type, content, created_at + timedelta(microseconds=index)))
+
+        for author_id, content in literal_eval(row.get("notes") or "[]"):
+            notes.append((row["id"], author_id, content))
+
+        for author_id, url, name in literal_eval(row.get("attachments") or "[]"):
+            attachments.append((row["id"], author_id, url, name))
+
+    await con.executemany("""INSERT INTO report_stances (report_id, author_id, type, content, created_at)
+                             VALUES ($1, $2, $3, $4, $5)
+                             ON CONFLICT (report_id, author_id) DO NOTHING;""",
+                          stances)
+    await con.executemany("""INSERT INTO report_notes (report_id, author_id, content)
+                             VALUES ($1, $2, $3);""",
+                          notes)
+    await con.executemany("""INSERT INTO report_attachments (report_id, author_id, url, name)
+                             VALUES ($1, $2, $3, $4);""",
+                          attachments)
+
+    await con.execute(f"ALTER TABLE bug_reports {', '.join(f'DROP COLUMN {c}' for c in sorted(legacy))};")
+
+    bot.log.info(f"Migrated {len(stances)} stances, {len(notes)} notes and {len(attachments)} attachments from {len(rows)} reports.")
+
+# The versioned schema, each migration is applied once (in order) inside its own transaction when Postgres connects.
+# A migration is either a tuple of statements or a coroutine function that takes the bot and a connection.
+# Never edit a migration that has shipped, add a new one instead.
+MIGRATIONS = [
+    (1, "create report tables", (
+        """CREATE TABLE IF NOT EXISTS bug_reports (id SERIAL PRIMARY KEY, reporter_id BIGINT, board_id BIGINT, message_id BIGINT, short_description TEXT, steps_to_reproduce TEXT, expected_result TEXT, actual_result TEXT, software_version TEXT, issue_url TEXT, issue_id INT, stance SMALLINT, locked BOOL, created_at TIMESTAMP);""",
+        """CREATE TABLE IF NOT EXISTS report_stances (report_id INT REFERENCES bug_reports (id) ON DELETE CASCADE, author_id BIGINT, type SMALLINT, content TEXT, created_at TIMESTAMP, PRIMARY KEY (report_id, author_id));""",
+        """CREATE TABLE IF NOT EXISTS report_notes (id SERIAL PRIMARY KEY, report_id INT REFERENCES bug_reports (id) ON DELETE CASCADE, author_id BIGINT, content TEXT, created_at TIMESTAMP);""",
+        """CREATE TABLE IF NOT EXISTS report_attachments (id SERIAL PRIMARY KEY, report_id INT REFERENCES bug_reports (id) ON DELETE CASCADE, author_id BIGINT, url TEXT, name TEXT, created_at TIMESTAMP);""",
+        """CREATE INDEX IF NOT EXISTS report_notes_report_id_idx ON report_notes (report_id);""",
+        """CREATE INDEX IF NOT EXISTS report_attachments_report_id_idx ON report_attachments (report_id);"""
+    )),
+    (2, "move legacy stances, notes and attachments", migrate_legacy_extras),
+    (3, "index the queue by stance and board", (
+        """CREATE INDEX IF NOT EXISTS bug_reports_stance_board_id_idx ON bug_reports (stance, board_id);""",
+    )),
+    (4, "index reports by reporter", (
+        """CREATE INDEX IF NOT EXISTS bug_reports_reporter_id_idx ON bug_reports (reporter_id);""",
+    )),
+    (5, "index reports by queue message", (
+        """CREATE INDEX IF NOT EXISTS bug_reports_message_id_idx ON bug_reports (message_id);""",
+    )),
+    (6, "index reports by creation time", (
+        """CREATE INDEX IF NOT EXISTS bug_reports_created_at_idx ON bug_reports (created_at);""",
+    )),
+    (7, "create the stance engine", (
+        # Votes on the same report are serialised by the row lock, so two votes can't both miss the threshold.
+        """CREATE OR REPLACE FUNCTION cast_stance(p_report INT, p_author BIGINT, p_type SMALLINT, p_content TEXT, p_needed INT, p_force BOOL)
+           RETURNS TABLE (approve_count INT, deny_count INT, previous SMALLINT, outcome SMALLINT, crossed BOOL) AS $$
+           DECLARE
+               v_reporter BIGINT;
+               v_previous SMALLINT;
+               v_approves INT;
+               v_denies INT;
+               v_outcome SMALLINT := 0;
+           BEGIN
+               SELECT r.reporter_id INTO v_reporter
+               FROM bug_reports r
+               WHERE r.id = p_report
+               AND r.stance = 0
+               AND NOT COALESCE(r.locked, FALSE)
+               FOR UPDATE;
+
+               IF NOT FOUND THEN
+                   RETURN;
+               END IF;
+
+               SELECT s.type INTO v_previous
+               FROM report_stances s
+               WHERE s.report_id = p_report
+               AND s.author_id = p_author;
+
+               INSERT INTO report_stances AS s (report_id, author_id, type, content, created_at)
+               VALUES (p_report, p_author, p_type, p_content, NOW() AT TIME ZONE 'UTC')
+               ON CONFLICT (report_id, author_id) DO UPDATE
+               SET type = EXCLUDED.type,
+               content = EXCLUDED.content,
+               created_at = EXCLUDED.created_at;
+
+               SELECT COUNT(*) FILTER (WHERE s.type = 1), COUNT(*) FILTER (WHERE s.type = -1) INTO v_approves, v_denies
+               FROM report_stances s
+               WHERE s.report_id = p_report;
+
+               IF p_type = 1 AND (p_force OR v_approves >= p_needed) THEN
+                   v_outcome := 1;
+
+               ELSIF p_type = -1 AND (p_force OR v_denies >= p_needed OR p_author = v_reporter) THEN
+                   v_outcome := -1;
+               END IF;
+
+               IF v_outcome <> 0 THEN
+                   UPDATE bug_reports r
+                   SET stance = v_outcome
+                   WHERE r.id = p_report;
+               END IF;
+
+               RETURN QUERY SELECT v_approves, v_denies, v_previous, v_outcome, v_outcome <> 0;
+           END;
+           $$ LANGUAGE plpgsql;""",
+    )),
+    (8, "version reports", (
+        """ALTER TABLE bug_reports ADD COLUMN IF NOT EXISTS version INT NOT NULL DEFAULT 0;""",
+    )),
+    (9, "compare and swap stances", (
+        """DROP FUNCTION IF EXISTS cast_stance(INT, BIGINT, SMALLINT, TEXT, INT, BOOL);""",
+        # Bumping the version takes the row lock, so a concurrent vote waits for this one and then fails its version check.
+        """CREATE OR REPLACE FUNCTION cast_stance(p_report INT, p_author BIGINT, p_type SMALLINT, p_content TEXT, p_needed INT, p_force BOOL, p_version INT)
+           RETURNS TABLE (approve_count INT, deny_count INT, previous SMALLINT, outcome SMALLINT, crossed BOOL) AS $$
+           DECLARE
+               v_reporter BIGINT;
+               v_previous SMALLINT;
+               v_approves INT;
+               v_denies INT;
+               v_outcome SMALLINT := 0;
+           BEGIN
+               UPDATE bug_reports r
+               SET version = r.version + 1
+               WHERE r.id = p_report
+               AND r.version = p_version
+               AND r.stance = 0
+               AND NOT COALESCE(r.locked, FALSE)
+               RETURNING r.reporter_id INTO v_reporter;
+
+               IF NOT FOUND THEN
+                   RETURN;
+               END IF;
+
+               SELECT s.type INTO v_previous
+               FROM report_stances s
+               WHERE s.report_id = p_report
+               AND s.author_id = p_author;
+
+               INSERT INTO report_stances AS s (report_id, author_id, type, content, created_at)
+               VALUES (p_report, p_author, p_type, p_content, NOW() AT TIME ZONE 'UTC')
+               ON CONFLICT (report_id, author_id) DO UPDATE
+               SET type = EXCLUDED.type,
+               content = EXCLUDED.content,
+               created_at = EXCLUDED.created_at;
+
+               SELECT COUNT(*) FILTER (WHERE s.type = 1), COUNT(*) FILTER (WHERE s.type = -1) INTO v_approves, v_denies
+               FROM report_stances s
+               WHERE s.report_id = p_report;
+
+               IF p_type = 1 AND (p_force OR v_approves >= p_needed) THEN
+                   v_outcome := 1;
+
+               ELSIF p_type = -1 AND (p_force OR v_denies >= p_needed OR p_author = v_reporter) THEN
+                   v_outcome := -1;
+               END IF;
+
+               IF v_outcome <> 0 THEN
+                   UPDATE bug_reports r
+                   SET stance = v_outcome
+                   WHERE r.id = p_report;
+               END IF;
+
+               RETURN QUERY SELECT v_approves, v_denies, v_previous, v_outcome, v_outcome <> 0;
+           END;
+           $$ LANGUAGE plpgsql;""",
+    )),
+    (10, "index reports missing a queue message", (
+        """CREATE INDEX IF NOT EXISTS bug_reports_unposted_idx ON bug_reports (id) WHERE message_id IS NULL AND stance = 0;""",
+    )),
+    (11, "create ephemeral message table", (
+        """CREATE TABLE IF NOT EXISTS ephemeral_messages (message_id BIGINT PRIMARY KEY, channel_id BIGINT NOT NULL, expires_at TIMESTAMP NOT NULL);""",
+    )),
+    (12, "create user profile table", (
+        """CREATE TABLE IF NOT EXISTS user_profiles (id BIGINT PRIMARY KEY, name TEXT NOT NULL, discriminator TEXT NOT NULL, avatar_url TEXT, updated_at TIMESTAMP NOT NULL);""",
+    )),
+    (13, "create github outbox", (
+        """ALTER TABLE bug_reports ADD COLUMN IF NOT EXISTS board_message_id BIGINT;""",
+        """CREATE TABLE IF NOT EXISTS github_outbox (id SERIAL PRIMARY KEY, report_id INT NOT NULL REFERENCES bug_reports (id) ON DELETE CASCADE, kind TEXT NOT NULL, repo TEXT NOT NULL, attempts INT NOT NULL DEFAULT 0, run_after TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc'), error TEXT, UNIQUE (report_id, kind));""",
+        """CREATE INDEX IF NOT EXISTS github_outbox_run_after_idx ON github_outbox (run_after);""",
+    )),
+    (14, "track github issue state", (
+        """ALTER TABLE bug_reports ADD COLUMN IF NOT EXISTS issue_state TEXT, ADD COLUMN IF NOT EXISTS issue_labels JSON, ADD COLUMN IF NOT EXISTS issue_updated_at TIMESTAMP;""",
+        """CREATE INDEX IF NOT EXISTS bug_reports_issue_id_board_id_idx ON bug_reports (issue_id, board_id) WHERE issue_id IS NOT NULL;""",
+    )),
+    (15, "create github sync state", (
+        """CREATE TABLE IF NOT EXISTS github_sync (repo TEXT PRIMARY KEY, etag TEXT, since TIMESTAMP, synced_at TIMESTAMP NOT NULL);""",
+    )),
+    (16, "queue board posts in the outbox", (
+        """ALTER TABLE github_outbox ALTER COLUMN repo DROP NOT NULL;""",
+    )),
+    (17, "record when outbox jobs were queued", (
+        """ALTER TABLE github_outbox ADD COLUMN IF NOT EXISTS created_at TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc');""",
+    )),
+    (18, "queue approvals and publish votes from the stance engine", (
+        """DROP FUNCTION IF EXISTS cast_stance(INT, BIGINT, SMALLINT, TEXT, INT, BOOL, INT);""",
+        # The outbox jobs and the change notification are part of the vote's own statement, so a vote is still one round-trip.
+        # A NULL p_board_after means there's no outbox to queue approvals in.
+        """CREATE OR REPLACE FUNCTION cast_stance(p_report INT, p_author BIGINT, p_type SMALLINT, p_content TEXT, p_needed INT, p_force BOOL, p_version INT,
+                                                 p_channel TEXT, p_origin TEXT, p_board_after TIMESTAMP, p_repo TEXT)
+           RETURNS TABLE (approve_count INT, deny_count INT, previous SMALLINT, outcome SMALLINT, crossed BOOL) AS $$
+           DECLARE
+               v_reporter BIGINT;
+               v_previous SMALLINT;
+               v_approves INT;
+               v_denies INT;
+               v_outcome SMALLINT := 0;
+           BEGIN
+               UPDATE bug_reports r
+               SET version = r.version + 1
+               WHERE r.id = p_report
+               AND r.version = p_version
+               AND r.stance = 0
+               AND NOT COALESCE(r.locked, FALSE)
+               RETURNING r.reporter_id INTO v_reporter;
+
+               IF NOT FOUND THEN
+                   RETURN;
+               END IF;
+
+               SELECT s.type INTO v_previous
+               FROM report_stances s
+               WHERE s.report_id = p_report
+               AND s.author_id = p_author;
+
+               INSERT INTO report_stances AS s (report_id, author_id, type, content, created_at)
+               VALUES (p_report, p_author, p_type, p_content, NOW() AT TIME ZONE 'UTC')
+               ON CONFLICT (report_id, author_id) DO UPDATE
+               SET type = EXCLUDED.type,
+               content = EXCLUDED.content,
+               created_at = EXCLUDED.created_at;
+
+               SELECT COUNT(*) FILTER (WHERE s.type = 1), COUNT(*) FILTER (WHERE s.type = -1) INTO v_approves, v_denies
+               FROM report_stances s
+               WHERE s.report_id = p_report;
+
+               IF p_type = 1 AND (p_force OR v_approves >= p_needed) THEN
+                   v_outcome := 1;
+
+               ELSIF p_type = -1 AND (p_force OR v_denies >= p_needed OR p_author = v_reporter) THEN
+                   v_outcome := -1;
+               END IF;
+
+               IF v_outcome <> 0 THEN
+                   UPDATE bug_reports r
+                   SET stance = v_outcome
+                   WHERE r.id = p_report;
+               END IF;
+
+               IF v_outcome = 1 AND p_board_after IS NOT NULL THEN
+                   INSERT INTO github_outbox (report_id, kind, repo, run_after)
+                   VALUES (p_report, 'board.post', NULL, p_board_after)
+                   ON CONFLICT (report_id, kind) DO NOTHING;
+
+                   IF p_repo IS NOT NULL THEN
+                       INSERT INTO github_outbox (report_id, kind, repo, run_after)
+                       VALUES (p_report, 'issue.create', p_repo, NOW() AT TIME ZONE 'UTC')
+                       ON CONFLICT (report_id, kind) DO NOTHING;
+                   END IF;
+               END IF;
+
+               PERFORM pg_notify(p_channel, json_build_object('id', p_report, 'fields', json_build_array('stances', 'stance'), 'origin', p_origin)::TEXT);
+
+               RETURN QUERY SELECT v_approves, v_denies, v_previous, v_outcome, v_outcome <> 0;
+           END;
+           $$ LANGUAGE plpgsql;""",
+    ))
+]
+
+# Held while migrating so that several processes booting at once don't race each other.
+MIGRATION_LOCK = 0x42756742
+
 class Plugin(commands.Cog, name="Postgres Plugin"):
     def __init__(self,
                  bot: commands.Bot):
         self.bot = bot
+        self.listener = None
+
+    def cog_unload(self):
+        if self.listener is not None:
+            self.bot.loop.create_task(self.listener.close())
+
+        self.bot.loop.create_task(self.bot.postgres.close())
+
+    def on_notification(self,
+                        con,
+                        pid: int,
+                        channel: str,
+                        payload: str):
+        """Evicts reports that have been written to by any process and dispatches report_change for anything else that holds report state."""
+
+        try:
+            change = loads(payload)
+
+        except ValueError:
+            return self.bot.log.warn(f"Received a malformed change notification: {payload}")
+
+        self.bot.reports.invalidate(change["id"])
+        self.bot.dispatch("report_change", change["id"], change["fields"], change["origin"] == ORIGIN)
+
+    async def subscribe(self):
+        """Opens a dedicated connection for receiving change notifications, pooled connections can't be used since they reset their listeners when released."""
+
+        if self.listener is not None and not self.listener.is_closed():
+            return
+
+        self.listener = await connect(**self.bot.postgres.options)
+        await self.listener.add_listener(NOTIFY_CHANNEL, self.on_notification)
+        self.listener.add_termination_listener(self.on_listener_terminate)
+
+    def on_listener_terminate(self,
+                              con):
+        """Resubscribes when the listener's connection is lost."""
+
+        self.bot.loop.create_task(self.resubscribe())
+
+    async def resubscribe(self):
+        """Keeps trying to subscribe until Postgres comes back, any reports changed in the meantime might be stale so the cache is dropped."""
+
+        delay = 1
+
+        while True:
+            try:
+                await self.subscribe()
+                break
+
+            except (OSError, PostgresError):
+                await sleep(delay)
+                delay = min(delay * 2, 60)
+
+        self.bot.reports.clear()
+
+    async def migrate(self,
+                      con):
+        """Applies any migrations that haven't been applied yet, in order."""
+
+        await con.execute("CREATE TABLE IF NOT EXISTS schema_migrations (version INT PRIMARY KEY, name TEXT, applied_at TIMESTAMP);")
+
+        for version, name, migration in MIGRATIONS:
+            async with con.transaction():
+                await con.execute("SELECT pg_advisory_xact_lock($1);",
+                                  MIGRATION_LOCK)
+
+                if await con.fetchval("SELECT 1 FROM schema_migrations WHERE version = $1;", version):
+                    continue
+
+                self.bot.log.info(f"Applying migration {version}: {name}")
+
+                if callable(migration):
+                    await migration(self.bot, con)
+
+                else:
+                    for query in migration:
+                        await con.execute(query)
+
+                await con.execute("INSERT INTO schema_migrations (version, name, applied_at) VALUES ($1, $2, $3);",
+                                  version, name, datetime.utcnow())
 
     @commands.Cog.listener()
     async def on_postgres_connect(self):
-        """Handles the creation of required tables when the connection is established."""
+        """Brings the schema up to date and prepares statements when the connection is established."""
 
         async with self.bot.postgres.acquire() as con:
-            queries = """CREATE TABLE IF NOT EXISTS bug_reports (id SERIAL PRIMARY KEY, reporter_id BIGINT, board_id BIGINT, message_id BIGINT, short_description TEXT, steps_to_reproduce TEXT, expected_result TEXT, actual_result TEXT, software_version TEXT, approves TEXT, denies TEXT, notes TEXT, attachments TEXT, issue_url TEXT, issue_id INT, stance SMALLINT, locked BOOL, created_at TIMESTAMP);""",
+            await self.migrate(con)
+
+        self.bot.queries.ready = True
+        await self.warm_up()
+        await self.subscribe()
+
+        self.bot.dispatch("postgres_ready")
+
+    async def warm_up(self):
+        """Prepares every registered statement on every open connection, so that the first commands after a deploy don't pay for it."""
 
-            for query in queries:
-                await con.execute(query)
+        # Every connection is held until all of them have been acquired, otherwise the same idle connection could be handed out twice.
+        async with AsyncExitStack() as stack:
+            for _ in range(self.bot.postgres.pool.get_idle_size()):
+                con = await stack.enter_async_context(self.bot.postgres.acquire())
+                await self.bot.queries.prepare(con)
+
+        self.bot.log.info(f"Prepared {len(self.bot.queries.queries)} statements on {len(self.bot.queries.statements)} connections.")
 
 def setup(bot: commands.Bot):
     if bot.config is None:
@@ -192,28 +1753,28 @@ def setup(bot: commands.Bot):
 
     config = bot.config.get("postgres", {})
 
+    bot.reports = ReportCache(size=config.get("cache_size", 256),
+                              ttl=config.get("cache_ttl", 60))
+
+    bot.approvals = ApprovalCache(bot, size=config.get("cache_size", 256))
+
+    profiles = bot.config.get("profiles", {})
+    bot.profiles = ProfileCache(bot,
+                                size=profiles.get("size", 1024),
+                                ttl=profiles.get("ttl", 3600),
+                                snapshot_ttl=profiles.get("snapshot_ttl", 604800),
+                                concurrency=profiles.get("concurrency", 5))
+    bot.queries = QueryRegistry(QUERIES)
+    bot.contention = Contention(retries=config.get("max_retries", 3))
+
     try:
-        if config.get("as_pool", False):
-            bot.postgres = bot.loop.run_until_complete(create_pool(
-                host=config.get("host", "127.0.0.1"),
-                port=config.get("port", "5432"),
-                user=config.get("user", "postgres"),
-                password=config.get("password"),
-                database=config.get("database", "postgres")
-            ))
-
-        else:
-            bot.postgres = bot.loop.run_until_complete(connect(
-                host=config.get("host", "127.0.0.1"),
-                port=config.get("port", "5432"),
-                user=config.get("user", "postgres"),
-                password=config.get("password"),
-                database=config.get("database", "postgres")
-            ))
+        bot.postgres = ConnectionManager(bot, config)
+        bot.postgres.init_hooks.append(bot.queries.init_connection)
+        bot.loop.run_until_complete(bot.postgres.connect())
         
         bot.log.info("Successfully connected to Postgres server.")
-        bot.dispatch("postgres_connect")
         bot.add_cog(Plugin(bot))
+        bot.dispatch("postgres_connect")
 
     except:
         bot.log.fatal(
@@ -0,0 +1,300 @@
+import discord
+
+from asyncio import sleep
+from datetime import datetime
+from discord.ext import commands
+
+
+DEFAULT_COLOR = 2105893
+
+ISSUE_STATES = {
+    "open": ":green_circle: Open",
+    "closed": ":purple_circle: Closed",
+    "deleted": ":wastebasket: Deleted"
+}
+
+def extra(emoji: str,
+          extras: list) -> str:
+    """Formats a list of extras (i.e. approves, denies, notes and attachments) with the provided emoji."""
+
+    if not extras:
+        return "*Nothing to show.*"
+
+    return "\n".join(f"{emoji} **{e.author}**: {e.content}" for e in extras)
+
+def parse_colors(bot: commands.Bot) -> dict:
+    """Parses the color of every board once, colors can be hex strings or integers in the config."""
+
+    colors = {}
+    for id, board in bot.config["channels"]["boards"].items():
+        color = board.get("color", DEFAULT_COLOR)
+        if isinstance(color, str):
+            try:
+                color = int(color, 16)
+
+            except ValueError:
+                color = DEFAULT_COLOR
+                bot.log.warn(f"Color for board {id} is malformed.")
+
+        colors[id] = color
+
+    return colors
+
+def base_embed(bot: commands.Bot,
+               board_id: int,
+               id: int,
+               reporter,
+               reporter_id: int,
+               short: str,
+               steps: list,
+               expected: str,
+               actual: str,
+               software: str,
+               created_at: datetime = None,
+               locked: bool = False,
+               url: str = discord.Embed.Empty) -> discord.Embed:
+    """Creates an embed with the parts of a report that only change when it's edited or locked."""
+
+    embed = discord.Embed(title=f"`🔒` {short}" if locked else short,
+                          timestamp=created_at or datetime.utcnow(),
+                          color=bot.embeds.colors.get(board_id, DEFAULT_COLOR))
+    embed.set_author(name=f"{reporter} ({reporter_id})",
+                     icon_url=getattr(reporter, "avatar_url", discord.Embed.Empty),
+                     url=url)
+    embed.set_footer(text=f"Report ID: #{id}")
+    embed.add_field(name="Steps to reproduce",
+                    value="\n".join(f"{i+1}. {step}" for i, step in enumerate(steps)),
+                    inline=False)
+    embed.add_field(name="Expected result",
+                    value=expected,
+                    inline=False)
+    embed.add_field(name="Actual result",
+                    value=actual,
+                    inline=False)
+    embed.add_field(name="Software version",
+                    value=software,
+                    inline=False)
+
+    return embed
+
+class EmbedRenderer:
+    """Renders report embeds, board colors are parsed once instead of on every render."""
+
+    def __init__(self,
+                 bot: commands.Bot):
+        self.bot = bot
+        self.colors: dict = parse_colors(bot)
+        self.renders: int = 0
+
+    def reload(self):
+        self.colors = parse_colors(self.bot)
+
+    def render(self,
+               report,
+               url: str = discord.Embed.Empty) -> discord.Embed:
+        self.renders += 1
+
+        embed = base_embed(self.bot, report.raw.get("board_id"),
+                           id=report.id,
+                           reporter=report.reporter,
+                           reporter_id=report.raw.get("reporter_id"),
+                           short=report.short,
+                           steps=report.steps,
+                           expected=report.expected,
+                           actual=report.actual,
+                           software=report.software,
+                           created_at=report.created_at,
+                           locked=report.locked and report.stance != -1,
+                           url=url)
+        emojis = self.bot.config["emojis"]
+
+        # Discord only accepts http(s) links as the author URL, so the lack of a repo goes in the footer instead.
+        board = self.bot.config["channels"]["boards"].get(report.raw.get("board_id"), {})
+        if board.get("repo") is None:
+            embed.set_footer(text=f"Report ID: #{report.id} | No configured repo")
+
+        if report.approves:
+            embed.add_field(name="Approvals",
+                            value=extra(emoji=emojis["tick_yes"],
+                                        extras=report.approves),
+                            inline=False)
+
+        if report.denies:
+            embed.add_field(name="Denials",
+                            value=extra(emoji=emojis["tick_no"],
+                                        extras=report.denies),
+                            inline=False)
+
+        if report.attachments:
+            embed.add_field(name="Attachments",
+                            value=extra(emoji=":paperclip:",
+                                        extras=report.attachments),
+                            inline=False)
+
+        if report.notes:
+            embed.add_field(name="Notes",
+                            value=extra(emoji=":pencil2:",
+                                        extras=report.notes),
+                            inline=False)
+
+        issue = report.issue
+        if issue.state is not None:
+            labels = ", ".join(f"`{label}`" for label in issue.labels) or "*No labels.*"
+            embed.add_field(name="GitHub issue",
+                            value=f"{ISSUE_STATES.get(issue.state, issue.state)} #{issue.id}\n{labels}",
+                            inline=False)
+
+        return embed
+
+    def stats(self) -> dict:
+        """Returns the render counters, these are shown by the stats command."""
+
+        return {
+            "renders": self.renders,
+            "boards": len(self.colors)
+        }
+
+def make_embed(bot: commands.Bot,
+               report,
+               url: str = discord.Embed.Empty) -> discord.Embed:
+    """Creates an embed out of the report provided."""
+
+    return bot.embeds.render(report, url)
+
+class Pending:
+    """The latest render requested for an approval queue message, and everyone waiting on it."""
+
+    __slots__ = ("report", "waiters")
+
+    def __init__(self):
+        self.report = None
+        self.waiters: list = []
+
+class RenderScheduler:
+    """Collapses approval queue edits for the same message into a single edit.
+
+    The first render goes out straight away, anything requested while it's in flight (or within the window after it) is merged into one edit showing the latest state."""
+
+    def __init__(self,
+                 bot: commands.Bot,
+                 window: float = 1.5):
+        self.bot = bot
+        self.window: float = window
+
+        self.entries: dict = {}
+        self.requests: int = 0
+        self.edits: int = 0
+        self.coalesced: int = 0
+        self.discarded: int = 0
+
+    async def render(self,
+                     report) -> bool:
+        """Schedules the report's approval queue message to be re-rendered.
+
+        Returns False if the message no longer exists."""
+
+        id = report.raw.get("message_id")
+        if id is None:
+            return False
+
+        self.requests += 1
+
+        entry = self.entries.get(id)
+        if entry is None:
+            entry = self.entries[id] = Pending()
+            self.bot.loop.create_task(self.run(id, entry))
+
+        entry.report = report
+
+        future = self.bot.loop.create_future()
+        entry.waiters.append(future)
+
+        return await future
+
+    async def run(self,
+                  id: int,
+                  entry: Pending):
+        """Keeps editing the message until nothing new has been requested for a whole window."""
+
+        try:
+            while entry.waiters:
+                report, waiters = entry.report, entry.waiters
+                entry.waiters = []
+
+                try:
+                    await report.resolve_users()
+                    message = await self.bot.approvals.edit(id,
+                                                            content=f"From: {report.board.mention}",
+                                                            embed=make_embed(self.bot, report))
+
+                except Exception as e:
+                    for waiter in waiters:
+                        if not waiter.done():
+                            waiter.set_exception(e)
+
+                else:
+                    for waiter in waiters:
+                        if not waiter.done():
+                            waiter.set_result(message is not None)
+
+                self.edits += 1
+                self.coalesced += len(waiters) - 1
+                await sleep(self.window)
+
+        finally:
+            if self.entries.get(id) is entry:
+                del self.entries[id]
+
+    def discard(self,
+                report):
+        """Drops any pending render for a report, used once it leaves the queue and its message is deleted."""
+
+        entry = self.entries.pop(report.raw.get("message_id"), None)
+        if entry is None:
+            return
+
+        for waiter in entry.waiters:
+            if not waiter.done():
+                waiter.set_result(True)
+
+        self.discarded += len(entry.waiters)
+        entry.waiters = []
+
+    def stats(self) -> dict:
+        """Returns the render counters, these are shown by the stats command."""
+
+        return {
+            "pending": len(self.entries),
+            "requests": self.requests,
+            "edits": self.edits,
+            "coalesced": self.coalesced,
+            "discarded": self.discarded
+        }
+
+class Plugin(commands.Cog, name="Render Scheduler"):
+    def __init__(self,
+                 bot: commands.Bot):
+        self.bot = bot
+
+    @commands.Cog.listener()
+    async def on_config_reload(self):
+        self.bot.embeds.reload()
+
+    @commands.Cog.listener()
+    async def on_report_approve(self,
+                                ctx: commands.Context,
+                                report):
+        self.bot.renders.discard(report)
+
+    @commands.Cog.listener()
+    async def on_report_deny(self,
+                             ctx: commands.Context,
+                             report):
+        self.bot.renders.discard(report)
+
+def setup(bot: commands.Bot):
+    config = bot.config.get("render", {})
+    bot.embeds = EmbedRenderer(bot)
+    bot.renders = RenderScheduler(bot, window=config.get("window", 1.5))
+
+    bot.add_cog(Plugin(bot))
\ No newline at end of file
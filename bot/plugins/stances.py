@@ -1,73 +1,6 @@
-import discord
-
 from datetime import datetime
 from discord.ext import commands
-from plugins.postgres import Report, Stance
-
-
-def extra(emoji: str,
-          extras: list) -> str:
-    """Formats a list of extras (i.e. approves, denies, notes and attachments) with the provided emoji."""
-
-    return "\n".join(f"{emoji} **{e.author}**: {e.content}" for e in extras)
-
-def make_embed(bot: commands.Bot,
-               report: Report) -> discord.Embed:
-    """Creates an embed out of the info provided."""
-
-    color = bot.config["channels"]["boards"][report.board.id].get("color", 2105893)
-    if isinstance(color, str):
-        try:
-            color = int(color, 16)
-    
-        except ValueError:
-            color = 2105893
-            bot.log.warn(f"Color for board {report.board} is malformed.")
-
-    embed = discord.Embed(title=f"`🔒` {report.short}" if report.locked else report.short,
-                          timestamp=report.created_at,
-                          color=color)
-    embed.set_author(name=f"{report.reporter} ({report.reporter.id})",
-                     icon_url=report.reporter.avatar_url)
-    embed.set_footer(text=f"Report ID: #{report.id}")
-    embed.add_field(name="Steps to reproduce",
-                    value="\n".join(f"{i+1}. {step}" for i, step in enumerate(report.steps)),
-                    inline=False)
-    embed.add_field(name="Expected result",
-                    value=report.expected,
-                    inline=False)
-    embed.add_field(name="Actual result",
-                    value=report.actual,
-                    inline=False)
-    embed.add_field(name="Software version",
-                    value=report.software,
-                    inline=False)
-
-    if report.approves:
-        embed.add_field(name="Approvals",
-                        value=extra(emoji=bot.config["emojis"]["tick_yes"],
-                                    extras=report.approves),
-                        inline=False)
-
-    if report.denies:
-        embed.add_field(name="Denials",
-                        value=extra(emoji=bot.config["emojis"]["tick_no"],
-                                    extras=report.denies),
-                        inline=False)
-
-    if report.attachments:
-        embed.add_field(name="Attachments",
-                        value=extra(emoji=":paperclip:",
-                                    extras=report.attachments),
-                        inline=False)
-
-    if report.notes:
-        embed.add_field(name="Notes",
-                        value=extra(emoji=":pencil2:",
-                                    extras=report.notes),
-                        inline=False)
-
-    return embed
+from plugins.postgres import Report, Stance, cast_stance, revoke_stance
 
 
 class Plugin(commands.Cog, name="Approval Commands"):
@@ -87,7 +20,7 @@ class Plugin(commands.Cog, name="Approval Commands"):
         This command only works from inside of the queue channel and does not support already approved/denied reports."""
 
         if ctx.guild.me.guild_permissions.manage_messages:
-            await ctx.message.delete()
+            self.bot.outbound.discard(ctx.message)
 
         if ctx.channel.id != self.bot.config["channels"]["approval"]:
             return
@@ -113,30 +46,7 @@ class Plugin(commands.Cog, name="Approval Commands"):
             return await ctx.failure("This report has already been moved.",
                                      delete_after=15)
 
-        stance = report.get_stance(ctx.author.id)
-
-        if stance is not None:
-            if stance.type == -1:
-                report.denies.remove(stance)
-
-            else:
-                report.approves.remove(stance)
-        
-        report.approves.append(Stance(1, ctx.author, info))
-
-        async with self.bot.postgres.acquire() as con:
-            query = """UPDATE bug_reports
-                       SET approves = $1,
-                       denies = $2,
-                       stance = $3
-                       WHERE id = $4;"""
-            
-            await con.execute(query,
-                              str(report.approves), str(report.denies), 1 if len(report.approves) >= self.bot.config["stances_needed"] else 0, report.id)
-
-        if await report.approval_message is None:
-            return await ctx.failure("The approval queue message no longer exists, please contact an Administrator.",
-                                     delete_after=15)
+        result = await cast_stance(self.bot, report, Stance(1, ctx.author, info))
 
         if report.reporter is None:
             return await ctx.failure("The user that made this report no longer exists, please contact an Administrator.",
@@ -146,15 +56,15 @@ class Plugin(commands.Cog, name="Approval Commands"):
             return await ctx.failure("The board for this report no longer exists, please contact an Administrator.",
                                      delete_after=15)
 
-        if len(report.approves) < self.bot.config["stances_needed"]:
-            msg = await report.approval_message
-            await msg.edit(content=f"From: {report.board.mention}",
-                           embed=make_embed(self.bot, report))
+        if not result["crossed"]:
+            if not await self.bot.renders.render(report):
+                return await ctx.failure("The approval queue message no longer exists, please contact an Administrator.",
+                                         delete_after=15)
 
         else:
             self.bot.dispatch("report_approve", ctx, report)
 
-        if stance is not None:
+        if result["previous"] is not None:
             return await ctx.success(f"You have changed your stance on report **#{report_id}**.",
                                      delete_after=15)
 
@@ -173,7 +83,7 @@ class Plugin(commands.Cog, name="Approval Commands"):
         This command only works from inside of the queue channel and does not support already approved/denied reports."""
 
         if ctx.guild.me.guild_permissions.manage_messages:
-            await ctx.message.delete()
+            self.bot.outbound.discard(ctx.message)
 
         if ctx.channel.id != self.bot.config["channels"]["approval"]:
             return
@@ -195,30 +105,7 @@ class Plugin(commands.Cog, name="Approval Commands"):
             return await ctx.failure("This report has already been moved.",
                                      delete_after=15)
 
-        stance = report.get_stance(ctx.author.id)
-
-        if stance is not None:
-            if stance.type == -1:
-                report.denies.remove(stance)
-
-            else:
-                report.approves.remove(stance)
-        
-        report.approves.append(Stance(1, ctx.author, info))
-
-        async with self.bot.postgres.acquire() as con:
-            query = """UPDATE bug_reports
-                       SET approves = $1,
-                       denies = $2,
-                       stance = $3
-                       WHERE id = $4;"""
-            
-            await con.execute(query,
-                              str(report.approves), str(report.denies), 1, report.id)
-
-        if await report.approval_message is None:
-            return await ctx.failure("The approval queue message no longer exists, please contact an Administrator.",
-                                     delete_after=15)
+        result = await cast_stance(self.bot, report, Stance(1, ctx.author, info), force=True)
 
         if report.reporter is None:
             return await ctx.failure("The user that made this report no longer exists, please contact an Administrator.",
@@ -230,7 +117,7 @@ class Plugin(commands.Cog, name="Approval Commands"):
 
         self.bot.dispatch("report_approve", ctx, report)
 
-        if stance is not None:
+        if result["previous"] is not None:
             return await ctx.success(f"You have changed your stance on report **#{report_id}**.",
                                      delete_after=15)
 
@@ -249,7 +136,7 @@ class Plugin(commands.Cog, name="Approval Commands"):
         This command only works from inside of the queue channel and does not support already approved/denied reports."""
 
         if ctx.guild.me.guild_permissions.manage_messages:
-            await ctx.message.delete()
+            self.bot.outbound.discard(ctx.message)
 
         if ctx.channel.id != self.bot.config["channels"]["approval"]:
             return
@@ -271,30 +158,7 @@ class Plugin(commands.Cog, name="Approval Commands"):
             return await ctx.failure("This report has already been moved.",
                                      delete_after=15)
 
-        stance = report.get_stance(ctx.author.id)
-
-        if stance is not None:
-            if stance.type == 1:
-                report.approves.remove(stance)
-
-            else:
-                report.denies.remove(stance)
-        
-        report.denies.append(Stance(-1, ctx.author, info))
-
-        async with self.bot.postgres.acquire() as con:
-            query = """UPDATE bug_reports
-                       SET approves = $1,
-                       denies = $2,
-                       stance = $3
-                       WHERE id = $4;"""
-            
-            await con.execute(query,
-                              str(report.approves), str(report.denies), -1 if len(report.denies) or report.reporter == ctx.author >= self.bot.config["stances_needed"] else 0, report.id)
-
-        if await report.approval_message is None:
-            return await ctx.failure("The approval queue message no longer exists, please contact an Administrator.",
-                                     delete_after=15)
+        result = await cast_stance(self.bot, report, Stance(-1, ctx.author, info))
 
         if report.reporter is None:
             return await ctx.failure("The user that made this report no longer exists, please contact an Administrator.",
@@ -304,15 +168,15 @@ class Plugin(commands.Cog, name="Approval Commands"):
             return await ctx.failure("The board for this report no longer exists, please contact an Administrator.",
                                      delete_after=15)
 
-        if len(report.denies) < self.bot.config["stances_needed"] and report.reporter != ctx.author:
-            msg = await report.approval_message
-            await msg.edit(content=f"From: {report.board.mention}",
-                           embed=make_embed(self.bot, report))
+        if not result["crossed"]:
+            if not await self.bot.renders.render(report):
+                return await ctx.failure("The approval queue message no longer exists, please contact an Administrator.",
+                                         delete_after=15)
 
         else:
             self.bot.dispatch("report_deny", ctx, report)
 
-        if stance is not None:
+        if result["previous"] is not None:
             return await ctx.success(f"You have changed your stance on report **#{report_id}**.",
                                      delete_after=15)
 
@@ -331,7 +195,7 @@ class Plugin(commands.Cog, name="Approval Commands"):
         This command only works from inside of the queue channel and does not support already approved/denied reports."""
 
         if ctx.guild.me.guild_permissions.manage_messages:
-            await ctx.message.delete()
+            self.bot.outbound.discard(ctx.message)
 
         if ctx.channel.id != self.bot.config["channels"]["approval"]:
             return
@@ -353,30 +217,7 @@ class Plugin(commands.Cog, name="Approval Commands"):
             return await ctx.failure("This report has already been moved.",
                                      delete_after=15)
 
-        stance = report.get_stance(ctx.author.id)
-
-        if stance is not None:
-            if stance.type == 1:
-                report.approves.remove(stance)
-
-            else:
-                report.denies.remove(stance)
-        
-        report.denies.append(Stance(-1, ctx.author, info))
-
-        async with self.bot.postgres.acquire() as con:
-            query = """UPDATE bug_reports
-                       SET approves = $1,
-                       denies = $2,
-                       stance = $3
-                       WHERE id = $4;"""
-            
-            await con.execute(query,
-                              str(report.approves), str(report.denies), -1, report.id)
-
-        if await report.approval_message is None:
-            return await ctx.failure("The approval queue message no longer exists, please contact an Administrator.",
-                                     delete_after=15)
+        result = await cast_stance(self.bot, report, Stance(-1, ctx.author, info), force=True)
 
         if report.reporter is None:
             return await ctx.failure("The user that made this report no longer exists, please contact an Administrator.",
@@ -388,7 +229,7 @@ class Plugin(commands.Cog, name="Approval Commands"):
 
         self.bot.dispatch("report_deny", ctx, report)
 
-        if stance is not None:
+        if result["previous"] is not None:
             return await ctx.success(f"You have changed your stance on report **#{report_id}**.",
                                      delete_after=15)
 
@@ -406,7 +247,7 @@ class Plugin(commands.Cog, name="Approval Commands"):
         This command only works from inside of the queue channel and does not support already approved/denied reports."""
 
         if ctx.guild.me.guild_permissions.manage_messages:
-            await ctx.message.delete()
+            self.bot.outbound.discard(ctx.message)
 
         if ctx.channel.id != self.bot.config["channels"]["approval"]:
             return await ctx.failure("This command can only be used in the approval queue.",
@@ -429,31 +270,11 @@ class Plugin(commands.Cog, name="Approval Commands"):
             return await ctx.failure("This report has already been moved.",
                                      delete_after=15)
 
-        stance = report.get_stance(ctx.author)
-
-        if stance is not None:
-            if stance.type == 1:
-                report.approves.remove(stance)
-
-            else:
-                report.denies.remove(stance)
-
-        else:
+        if report.get_stance(ctx.author.id) is None:
             return await ctx.failure("You haven't placed a stance on this report yet.",
                                      delete_after=15)
 
-        async with self.bot.postgres.acquire() as con:
-            query = """UPDATE bug_reports
-                       SET approves = $1,
-                       denies = $2
-                       WHERE id = $3;"""
-
-            await con.execute(query,
-                              str(report.approves), str(report.denies), report.id)
-
-        if await report.approval_message is None:
-            return await ctx.failure("The approval queue message no longer exists, please contact an Administrator.",
-                                     delete_after=15)
+        await revoke_stance(self.bot, report, ctx.author.id)
 
         if report.reporter is None:
             return await ctx.failure("The user that made this report no longer exists, please contact an Administrator.",
@@ -463,9 +284,9 @@ class Plugin(commands.Cog, name="Approval Commands"):
             return await ctx.failure("The board for this report no longer exists, please contact an Administrator.",
                                      delete_after=15)
 
-        msg = await report.approval_message
-        await msg.edit(content=f"From: {report.board.mention}",
-                       embed=make_embed(self.bot, report))
+        if not await self.bot.renders.render(report):
+            return await ctx.failure("The approval queue message no longer exists, please contact an Administrator.",
+                                     delete_after=15)
         
         await ctx.success(f"You have revoked your stance on report **#{report_id}**.",
                           delete_after=15)
@@ -0,0 +1,102 @@
+from discord.ext import commands
+
+
+# Maps a heading to the attribute on the bot that exposes a stats() method.
+# Anything that isn't attached to the bot (i.e. its plugin isn't loaded) is skipped.
+SOURCES = {
+    "Gateway": "gateway",
+    "Cluster": "cluster",
+    "Report cache": "reports",
+    "User profiles": "profiles",
+    "Approval messages": "approvals",
+    "Approval renders": "renders",
+    "Report embeds": "embeds",
+    "Outbound actions": "outbound",
+    "GitHub API": "github",
+    "GitHub outbox": "outbox",
+    "GitHub webhooks": "webhooks",
+    "Issue sync": "issues",
+    "Issue polling": "poller",
+    "Board edits": "boards",
+    "Stray cleanup": "strays",
+    "Ephemeral messages": "expiry",
+    "Postgres pool": "postgres",
+    "Prepared statements": "queries",
+    "Report contention": "contention"
+}
+
+def collect(bot: commands.Bot) -> dict:
+    """Returns the stats of every source that's loaded, keyed by heading."""
+
+    stats = {}
+    for heading, attr in SOURCES.items():
+        source = getattr(bot, attr, None)
+        if source is not None:
+            stats[heading] = source.stats()
+
+    return stats
+
+# Discord's limit on the length of a message.
+MAX_MESSAGE_LENGTH = 2000
+
+def format_stats(stats: dict,
+                 header: str = None) -> list:
+    """Formats stats into as few messages as fit under Discord's length limit, a message only breaks between sections unless one section is too long by itself."""
+
+    messages, current = [], [header] if header else []
+
+    def flush():
+        nonlocal current
+        if current:
+            messages.append("\n".join(current))
+
+        current = []
+
+    for heading, values in stats.items():
+        section = [f"**{heading}**", *(f"`{key}`: {value}" for key, value in values.items())]
+
+        if len("\n".join(current + section)) > MAX_MESSAGE_LENGTH:
+            flush()
+
+        for line in section:
+            if current and len("\n".join(current + [line])) > MAX_MESSAGE_LENGTH:
+                flush()
+
+            current.append(line[:MAX_MESSAGE_LENGTH])
+
+    flush()
+    return messages or [header or "*Nothing to show.*"]
+
+class Plugin(commands.Cog, name="Stats Command"):
+    def __init__(self,
+                 bot: commands.Bot):
+        self.bot = bot
+
+        # Other workers ask for this process' stats over the cluster channel.
+        cluster = getattr(bot, "cluster", None)
+        if cluster is not None:
+            cluster.handlers["stats"] = lambda message: collect(self.bot)
+
+    @commands.is_owner()
+    @commands.command(name="stats",
+                      usage="stats")
+    async def stats(self,
+                    ctx: commands.Context):
+        """Shows the internal counters of the bot's caches, pools and queues.
+        
+        In a cluster, every worker's counters are shown. This is only available to owners of the bot."""
+
+        cluster = getattr(self.bot, "cluster", None)
+        if cluster is None or cluster.workers == 1:
+            for message in format_stats(collect(self.bot)):
+                await self.bot.outbound.send(ctx, message)
+
+            return
+
+        # Each worker starts a new message, all of them together won't fit in one.
+        for reply in await cluster.request("stats"):
+            for message in format_stats(reply["result"], f"__**Worker {reply['worker']}**__"):
+                await self.bot.outbound.send(ctx, message)
+
+def setup(bot: commands.Bot):
+    bot.add_cog(Plugin(bot))
\ No newline at end of file
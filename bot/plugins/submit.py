@@ -1,8 +1,14 @@
 import discord
 
 from argparse import ArgumentParser
-from datetime import datetime
-from discord.ext import commands
+from asyncio import Lock
+from asyncpg import PostgresError
+from datetime import datetime, timedelta
+from discord.ext import commands, tasks
+from plugins.cluster import is_leader
+from plugins.outbound import Priority
+from plugins.postgres import Report, publish_change
+from plugins.render import base_embed
 
 
 class ArgumentParser(ArgumentParser):    
@@ -42,46 +48,126 @@ parser.add_argument("-sv",
                     type=str,
                     nargs="+")
 
-def make_embed(bot: commands.Bot,
-               board: discord.TextChannel,
-               **info: dict) -> discord.Embed:
-    """Creates an embed out of the info provided."""
-
-    color = bot.config["channels"]["boards"][board.id].get("color", 2105893)
-    if isinstance(color, str):
-        try:
-            color = int(color, 16)
-    
-        except ValueError:
-            color = 2105893
-            bot.log.warn(f"Color for board {board} is malformed.")
-
-    embed = discord.Embed(title=info["short"],
-                          timestamp=datetime.utcnow(),
-                          color=color)
-    embed.set_author(name=f"{info['reporter']} ({info['reporter'].id})",
-                     icon_url=info["reporter"].avatar_url)
-    embed.set_footer(text=f"Report ID: #{info['id']}")
-    embed.add_field(name="Steps to reproduce",
-                    value="\n".join(f"{i+1}. {step}" for i, step in enumerate(info["steps"])),
-                    inline=False)
-    embed.add_field(name="Expected result",
-                    value=info["expected"],
-                    inline=False)
-    embed.add_field(name="Actual result",
-                    value=info["actual"],
-                    inline=False)
-    embed.add_field(name="Software version",
-                    value=info["software"],
-                    inline=False)
-
-    return embed
-
 class Plugin(commands.Cog, name="Submit Command"):
     def __init__(self,
                  bot: commands.Bot):
         self.bot = bot
 
+        config = bot.config.get("submit", {})
+
+        # Queue message IDs that haven't been written yet, keyed by report ID.
+        # Each is written as soon as its message is sent, on a connection that's only held for the write. Anything that fails stays here and is retried.
+        self.pending: dict = {}
+        self.lock: Lock = Lock()
+        self.recovery_grace: float = config.get("recovery_grace", 60)
+
+        self.flush_pending.change_interval(seconds=config.get("flush_interval", 2))
+        self.flush_pending.start()
+
+        self.recover.change_interval(seconds=config.get("recovery_interval", 300))
+        self.recover.start()
+
+    def cog_unload(self):
+        self.flush_pending.cancel()
+        self.recover.cancel()
+
+        self.bot.loop.create_task(self.flush())
+
+    async def queue_message(self,
+                            id: int,
+                            message: discord.Message):
+        """Writes the queue message for a report straight away, so votes can render it and recovery doesn't repost it."""
+
+        self.pending[id] = message.id
+        self.bot.approvals.put(message)
+
+        await self.flush()
+
+    async def flush(self):
+        """Writes every pending queue message ID in a single statement, submissions that arrive during a write are written together with the next."""
+
+        async with self.lock:
+            if not self.pending:
+                return
+
+            pending, self.pending = self.pending, {}
+
+            try:
+                async with self.bot.postgres.acquire() as con:
+                    async with con.transaction():
+                        await self.bot.queries.execute(con, "report.messages",
+                                                       list(pending.keys()), list(pending.values()))
+
+                        for id in pending:
+                            await publish_change(self.bot, con, id, "message_id")
+
+            except (OSError, PostgresError):
+                # Anything newer that came in while this was failing takes priority.
+                self.pending = {**pending, **self.pending}
+                self.bot.log.error(f"Failed to write {len(pending)} queue message IDs, retrying shortly.",
+                                   exc_info=True)
+
+    @tasks.loop(seconds=2)
+    async def flush_pending(self):
+        await self.flush()
+
+    @tasks.loop(seconds=300)
+    async def recover(self):
+        """Posts queue messages for reports that were saved but never made it to the queue (i.e. Discord failed or the bot restarted).
+        
+        This only runs on the cluster leader, otherwise every worker would post the same reports."""
+
+        if not is_leader(self.bot):
+            return
+
+        queue = self.bot.get_channel(self.bot.config["channels"]["approval"])
+        if queue is None:
+            return
+
+        async with self.bot.postgres.acquire() as con:
+            ids = await self.bot.queries.fetch(con, "report.unposted",
+                                               datetime.utcnow() - timedelta(seconds=self.recovery_grace))
+
+        for row in ids:
+            if row["id"] in self.pending:
+                continue
+
+            report = await Report.from_db(self.bot, row["id"])
+            if report is None or report.board is None:
+                continue
+
+            await report.resolve_users()
+
+            reporter = report.reporter
+            if isinstance(reporter, int):
+                continue
+
+            try:
+                message = await self.bot.outbound.send(queue, f"From: {report.board.mention}",
+                                                       embed=base_embed(self.bot, report.board.id,
+                                                                        id=report.id,
+                                                                        reporter=reporter,
+                                                                        reporter_id=reporter.id,
+                                                                        short=report.short,
+                                                                        steps=report.steps,
+                                                                        expected=report.expected,
+                                                                        actual=report.actual,
+                                                                        software=report.software,
+                                                                        created_at=report.created_at),
+                                                       priority=Priority.EDIT)
+
+            except discord.HTTPException:
+                self.bot.log.warn(f"Couldn't post report #{report.id} to the approval queue, retrying later.",
+                                  exc_info=True)
+                break
+
+            await self.queue_message(report.id, message)
+            self.bot.log.info(f"Recovered report #{report.id}, it's now in the approval queue.")
+
+    @recover.before_loop
+    async def before_recover(self):
+        await self.bot.wait_until_ready()
+
     @commands.guild_only()
     @commands.command(name="submit",
                       usage="submit -t <short:text> -s <steps:many[text ~]> -e <expected:text> -a <actual:text> -sv <version:text>")
@@ -93,7 +179,7 @@ class Plugin(commands.Cog, name="Submit Command"):
         config = self.bot.config
 
         if ctx.guild.me.guild_permissions.manage_messages:
-            await ctx.message.delete()
+            self.bot.outbound.discard(ctx.message)
 
         if ctx.channel.id not in config["channels"]["boards"].keys():
             return await ctx.failure("You must be in a bug board to use this command.",
@@ -128,30 +214,28 @@ class Plugin(commands.Cog, name="Submit Command"):
                                      delete_after=15)
 
         async with self.bot.postgres.acquire() as con:
-            query = """INSERT INTO bug_reports (reporter_id, board_id, short_description, steps_to_reproduce, expected_result, actual_result, software_version, stance, created_at)
-                       VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9)
-                       
-                       RETURNING id;"""
-
-            id = await con.fetchval(query,
-                                    ctx.author.id, ctx.channel.id, data["title"], str(steps), data["expected"], data["actual"], data["software"], 0, datetime.utcnow())
-
-            message = await queue.send(f"From: {ctx.channel.mention}",
-                                       embed=make_embed(self.bot, ctx.channel,
-                                                        id=id,
-                                                        reporter=ctx.author,
-                                                        short=data["title"],
-                                                        steps=steps,
-                                                        expected=data["expected"],
-                                                        actual=data["actual"],
-                                                        software=data["software"]))
-
-            query = """UPDATE bug_reports
-                       SET message_id = $1
-                       WHERE id = $2;"""
-
-            await con.execute(query,
-                              message.id, id)
+            id = await self.bot.queries.fetchval(con, "report.insert",
+                                                 ctx.author.id, ctx.channel.id, data["title"], str(steps), data["expected"], data["actual"], data["software"], 0, datetime.utcnow())
+
+        # The connection is released before talking to Discord, the message ID is written on a fresh one as soon as the message is sent.
+        try:
+            message = await self.bot.outbound.send(queue, f"From: {ctx.channel.mention}",
+                                                   embed=base_embed(self.bot, ctx.channel.id,
+                                                                    id=id,
+                                                                    reporter=ctx.author,
+                                                                    reporter_id=ctx.author.id,
+                                                                    short=data["title"],
+                                                                    steps=steps,
+                                                                    expected=data["expected"],
+                                                                    actual=data["actual"],
+                                                                    software=data["software"]),
+                                                   priority=Priority.EDIT)
+
+        except discord.HTTPException:
+            return await ctx.failure(f"Your report (**#{id}**) was saved but couldn't be posted to the approval queue, it'll be posted shortly.",
+                                     delete_after=15)
+
+        await self.queue_message(id, message)
 
 def setup(bot: commands.Bot):
     bot.add_cog(Plugin(bot))
\ No newline at end of file
@@ -0,0 +1,189 @@
+import hmac
+
+from aiohttp import ClientError, ClientSession, web
+from datetime import datetime
+from discord.ext import commands
+from hashlib import sha256
+from json import dumps, loads
+from plugins.postgres import Report
+
+
+def sign(secret: str,
+         body: bytes) -> str:
+    """Returns the X-Hub-Signature-256 header GitHub sends with a body."""
+
+    return "sha256=" + hmac.new(secret.encode(), body, sha256).hexdigest()
+
+class WebhookServer:
+    """Receives GitHub webhooks and hands issue events to the issue sync.
+
+    Deliveries without a valid signature are refused before their body is parsed.
+    Nothing is written while GitHub waits for the response, the sync writes deliveries in batches."""
+
+    def __init__(self,
+                 bot: commands.Bot,
+                 secret: str,
+                 host: str = "0.0.0.0",
+                 port: int = 8080,
+                 path: str = "/github"):
+        self.bot = bot
+        self.secret: str = secret
+        self.host: str = host
+        self.port: int = port
+        self.path: str = path
+        self.runner: web.AppRunner = None
+
+        self.received: int = 0
+        self.rejected: int = 0
+        self.ignored: int = 0
+        self.malformed: int = 0
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, self.host, self.port).start()
+
+        self.bot.log.info(f"Listening for GitHub webhooks on {self.host}:{self.port}{self.path}.")
+
+    async def close(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+    async def handle(self,
+                     request: web.Request) -> web.Response:
+        body = await request.read()
+
+        if not hmac.compare_digest(sign(self.secret, body), request.headers.get("X-Hub-Signature-256", "")):
+            self.rejected += 1
+            return web.Response(status=401, text="Bad signature.")
+
+        event = request.headers.get("X-GitHub-Event")
+        if event == "ping":
+            return web.Response(text="pong")
+
+        if event != "issues":
+            self.ignored += 1
+            return web.Response(status=202, text="Ignored.")
+
+        try:
+            payload = loads(body)
+            issue, repo = payload["issue"], payload["repository"]["full_name"]
+
+            # A deleted issue is sent as it was before it was deleted.
+            if payload.get("action") == "deleted":
+                issue = {**issue, "state": "deleted"}
+
+            self.bot.issues.queue(repo, issue)
+
+        except (ValueError, KeyError, TypeError):
+            self.malformed += 1
+            return web.Response(status=400, text="Malformed payload.")
+
+        self.received += 1
+        return web.Response(status=202, text="Accepted.")
+
+    def stats(self) -> dict:
+        """Returns the delivery counters, these are shown by the stats command."""
+
+        return {
+            "listening": self.runner is not None,
+            "received": self.received,
+            "rejected": self.rejected,
+            "ignored": self.ignored,
+            "malformed": self.malformed
+        }
+
+class Plugin(commands.Cog, name="GitHub Webhooks"):
+    def __init__(self,
+                 bot: commands.Bot):
+        self.bot = bot
+
+    def cog_unload(self):
+        self.bot.loop.create_task(self.bot.webhooks.close())
+
+    @commands.Cog.listener()
+    async def on_postgres_ready(self):
+        config = self.bot.config.get("webhooks", {})
+
+        # Only one process can bind the port, every worker sees the changes it writes anyway.
+        if self.bot.webhooks.runner is not None or self.bot.worker[0] != config.get("worker", 0):
+            return
+
+        try:
+            await self.bot.webhooks.start()
+
+        except OSError:
+            self.bot.log.error("Couldn't start the GitHub webhook server.",
+                               exc_info=True)
+
+    @commands.is_owner()
+    @commands.command(name="webhook",
+                      usage="webhook <report_id:num> [state:text]")
+    async def webhook(self,
+                      ctx: commands.Context,
+                      report_id: int,
+                      state: str = "closed"):
+        """Sends a signed issues event for a report's GitHub issue to the local webhook server, like GitHub would.
+
+        This is only available to owners of the bot."""
+
+        report = await Report.from_db(self.bot, report_id)
+        if report is None:
+            return await ctx.failure(f"Report #{report_id} doesn't exist.",
+                                     delete_after=15)
+
+        board = self.bot.config["channels"]["boards"].get(report.raw.get("board_id"), {})
+        if report.issue.id is None or board.get("repo") is None:
+            return await ctx.failure(f"Report #{report_id} doesn't have a GitHub issue.",
+                                     delete_after=15)
+
+        webhooks = self.bot.webhooks
+        body = dumps({
+            "action": "closed" if state == "closed" else "reopened" if state == "open" else state,
+            "issue": {
+                "number": report.issue.id,
+                "state": state,
+                "labels": [{"name": label} for label in report.issue.labels],
+                "updated_at": datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
+            },
+            "repository": {
+                "full_name": board["repo"]
+            }
+        }).encode()
+
+        host = "127.0.0.1" if webhooks.host in ("0.0.0.0", "") else webhooks.host
+
+        try:
+            async with ClientSession() as session:
+                async with session.post(f"http://{host}:{webhooks.port}{webhooks.path}",
+                                        data=body,
+                                        headers={
+                                            "Content-Type": "application/json",
+                                            "X-GitHub-Event": "issues",
+                                            "X-Hub-Signature-256": sign(webhooks.secret, body)
+                                        }) as res:
+                    text = await res.text()
+
+        except ClientError as e:
+            return await ctx.failure(f"Couldn't reach the webhook server: {e}",
+                                     delete_after=15)
+
+        await ctx.success(f"Webhook server answered `{res.status}`: {text}",
+                          delete_after=15)
+
+def setup(bot: commands.Bot):
+    config = bot.config.get("webhooks", {})
+    if config.get("secret") is None:
+        return bot.log.warn("Not receiving GitHub webhooks, reason: no webhook secret in the config.")
+
+    bot.webhooks = WebhookServer(bot,
+                                 secret=config["secret"],
+                                 host=config.get("host", "0.0.0.0"),
+                                 port=config.get("port", 8080),
+                                 path=config.get("path", "/github"))
+
+    bot.add_cog(Plugin(bot))
\ No newline at end of file